@@ -81,6 +81,17 @@ DATABASES = {
     }
 }
 
+# Link sharding (see shortener/sharding.py)
+# Database aliases that hold ShortenedURL and its per-link tables; empty keeps
+# everything on 'default'. For example, with extra 'shard_0' and 'shard_1'
+# entries in DATABASES:
+#     SHORTENER_SHARDS = ['shard_0', 'shard_1']
+# then `manage.py migrate --database=<alias>` for each alias and run
+# `manage.py rebalance_shards` whenever this list changes.
+SHORTENER_SHARDS = []
+
+DATABASE_ROUTERS = ['shortener.sharding.ShardRouter']
+
 
 
 # Password validation
@@ -128,3 +139,117 @@ MEDIA_ROOT = BASE_DIR / 'media'
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Link expiry
+# Short codes freed by the expiry reaper are held back for this many days
+# before they can be handed out again.
+LINK_CODE_QUARANTINE_DAYS = 30
+
+# Hot/cold tiering
+# Links not clicked for this many days are moved to the archive table by
+# `manage.py tier_links`.
+LINK_ARCHIVE_IDLE_DAYS = 90
+
+# Click counting
+# Seconds to buffer click counts in memory before writing them to the
+# database. 0 writes every click immediately.
+CLICK_FLUSH_INTERVAL = 0
+
+# Redirect snapshot
+# When set, redirect_url resolves codes from the snapshot file built by
+# `manage.py build_redirect_snapshot` and only falls back to the database for
+# links created since. Pair with a non-zero CLICK_FLUSH_INTERVAL so snapshot
+# hits do not write to the database on every request.
+REDIRECT_SNAPSHOT_PATH = None
+REDIRECT_SNAPSHOT_CHECK_INTERVAL = 1.0
+# Links edited, archived or deleted after a build are revoked in this cache
+# so they stop redirecting from the snapshot at once. Revocations expire after
+# REDIRECT_SNAPSHOT_REVOCATION_TTL seconds, so rebuild the snapshot more
+# often than that.
+REDIRECT_SNAPSHOT_CACHE_ALIAS = 'snapshot'
+REDIRECT_SNAPSHOT_REVOCATION_TTL = 60 * 60 * 24 * 7
+
+# Unique visitors
+# Seconds to buffer visitor sketches in memory before merging them into the
+# database. Each merge rewrites a day row and the all-time row of the link, so
+# unlike click counts these are buffered by default.
+VISITOR_FLUSH_INTERVAL = 5
+# Daily sketches older than this are deleted by `manage.py reap_expired_links
+# --purge`; the all-time sketch of each link is kept.
+VISITOR_SKETCH_RETENTION_DAYS = 90
+
+# Trending links
+# Redirects are counted over a sliding window of TRENDING_WINDOW seconds,
+# split into TRENDING_BUCKETS buckets. Each bucket tracks at most
+# TRENDING_CAPACITY links; any link with more than 1/TRENDING_CAPACITY of a
+# bucket's redirects is guaranteed to be among them.
+TRENDING_WINDOW = 3600
+TRENDING_BUCKETS = 12
+TRENDING_CAPACITY = 100
+# Seconds each process buffers its counts before publishing them to the cache
+TRENDING_FLUSH_INTERVAL = 5
+TRENDING_CACHE_ALIAS = 'trending'
+
+# Link health checks
+# `manage.py check_links` only connects to public addresses, so links cannot
+# point it at this server's network. Enable to check destinations on
+# loopback or private ranges, e.g. in development.
+LINK_CHECK_ALLOW_PRIVATE_ADDRESSES = False
+
+# Caches
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Rendered QR codes, shared by all worker processes and the
+    # pregenerate_qr_codes command
+    'qr': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'qr',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+    # Session data, shared by all worker processes
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'sessions',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+    # Codes revoked from the redirect snapshot, shared by all worker processes
+    'snapshot': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'snapshot',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+    # Trending link counters, merged across worker processes
+    'trending': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'trending',
+    },
+}
+
+QR_CODE_CACHE_ALIAS = 'qr'
+
+# Profile photos
+# Square thumbnails generated for every upload, in pixels. The largest one is
+# served by default.
+PROFILE_PHOTO_THUMBNAIL_SIZES = (64, 160, 320)
+# Background threads that process uploads; 0 processes them inline. Uploads
+# left unprocessed by a restart or a failure are retried with
+# `manage.py process_profile_photos`.
+PROFILE_PHOTO_WORKERS = 2
+
+# Sessions
+# https://docs.djangoproject.com/en/5.0/topics/http/sessions/
+# 'shortener.sessions' serves sessions from the cache and batches database
+# writes. For lightweight sessions that never touch the server, use
+# 'django.contrib.sessions.backends.signed_cookies' instead.
+
+SESSION_ENGINE = 'shortener.sessions'
+SESSION_CACHE_ALIAS = 'sessions'
+# Seconds between batched session writes to the database
+SESSION_WRITE_BEHIND_INTERVAL = 5
+
+# Keep flash messages in a cookie so they never dirty the session
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
@@ -1,10 +1,189 @@
+from collections import defaultdict
+
+from django.conf import settings
 from django.contrib import admin
-from .models import ShortenedURL
+from django.contrib.admin.utils import NestedObjects
+from django.http import QueryDict
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils.text import capfirst
+from .models import ShortenedURL, ArchivedURL, ExpiredURL, LinkHealth, APIToken
+from .search import search_links
+from .sharding import shard_aliases, shard_for, sharding_enabled
+from .trending import trending_links
+
+
+def selected_shard(request):
+    """Shard the admin is browsing, from ?shard= or the changelist filters a change page preserves"""
+    shard = request.GET.get(ShardListFilter.parameter_name)
+    if shard is None:
+        preserved = QueryDict(request.GET.get('_changelist_filters', ''))
+        shard = preserved.get(ShardListFilter.parameter_name)
+    aliases = shard_aliases()
+    return shard if shard in aliases else aliases[0]
+
+
+class ShardListFilter(admin.SimpleListFilter):
+    """Pick which shard's rows the changelist shows; there is no "All" choice"""
+    title = 'shard'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in shard_aliases()]
+
+    def queryset(self, request, queryset):
+        # ShardedModelAdmin.get_queryset has already picked the database
+        return queryset
+
+    def choices(self, changelist):
+        current = self.value() if self.value() in shard_aliases() else shard_aliases()[0]
+        for lookup, title in self.lookup_choices:
+            yield {
+                'selected': lookup == current,
+                'query_string': changelist.get_query_string({self.parameter_name: lookup}),
+                'display': title,
+            }
+
+
+class RetireOnDeleteMixin:
+    """Delete links with retire(), so their codes are quarantined like expired ones"""
+
+    def delete_model(self, request, obj):
+        obj.retire()
+
+    def delete_queryset(self, request, queryset):
+        for obj in queryset:
+            obj.retire()
+
+
+class ShardedModelAdmin(admin.ModelAdmin):
+    """
+    Admin for a model in SHARDED_MODELS.
+
+    Django's admin reads and writes through the router without an instance to
+    route by, which would land on 'default'. With sharding on, each page works
+    on one shard picked with ShardListFilter and rows are only added through
+    the site or the API.
+    """
+    # Fields a row is placed by, read-only once it exists: changing them would
+    # strand it on the wrong shard and leave the old code in the redirect snapshot
+    shard_key_fields = ('short_code',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).using(selected_shard(request))
+
+    def get_list_filter(self, request):
+        list_filter = super().get_list_filter(request)
+        if sharding_enabled():
+            return (ShardListFilter, *list_filter)
+        return list_filter
+
+    def get_readonly_fields(self, request, obj=None):
+        readonly_fields = super().get_readonly_fields(request, obj)
+        if obj is not None or sharding_enabled():
+            return (*readonly_fields, *self.shard_key_fields)
+        return readonly_fields
+
+    def has_add_permission(self, request):
+        return not sharding_enabled() and super().has_add_permission(request)
+
+    def get_deleted_objects(self, objs, request):
+        if not sharding_enabled():
+            return super().get_deleted_objects(objs, request)
+        # Django's helper collects related rows on 'default'; collect on the shard instead
+        collector = NestedObjects(using=selected_shard(request), origin=objs)
+        collector.collect(objs)
+        perms_needed = {
+            model._meta.verbose_name
+            for model in collector.model_objs
+            if self.admin_site.is_registered(model)
+            and not self.admin_site.get_model_admin(model).has_delete_permission(request)
+        }
+        model_count = {
+            model._meta.verbose_name_plural: len(instances)
+            for model, instances in collector.model_objs.items()
+        }
+        to_delete = collector.nested(lambda obj: f'{capfirst(obj._meta.verbose_name)}: {obj}')
+        protected = [f'{capfirst(obj._meta.verbose_name)}: {obj}' for obj in collector.protected]
+        return to_delete, model_count, perms_needed, protected
+
 
 @admin.register(ShortenedURL)
-class ShortenedURLAdmin(admin.ModelAdmin):
-    list_display = ('short_code', 'original_url', 'clicks', 'created_at')
-    list_filter = ('created_at',)
+class ShortenedURLAdmin(RetireOnDeleteMixin, ShardedModelAdmin):
+    list_display = ('short_code', 'original_url', 'clicks', 'created_at', 'expires_at', 'max_clicks')
+    list_filter = ('created_at', 'expires_at')
     search_fields = ('short_code', 'original_url')
     readonly_fields = ('created_at', 'clicks')
-    ordering = ('-created_at',)
\ No newline at end of file
+    ordering = ('-created_at',)
+
+    def get_search_results(self, request, queryset, search_term):
+        # Use the search index instead of LIKE '%...%' over original_url
+        if not search_term:
+            return queryset, False
+        return search_links(queryset, search_term), False
+
+    def get_urls(self):
+        return [
+            path('trending/', self.admin_site.admin_view(self.trending_view),
+                 name='shortener_shortenedurl_trending'),
+        ] + super().get_urls()
+
+    def trending_view(self, request):
+        links = trending_links(50)
+        # One query per shard for the destinations
+        codes_by_shard = defaultdict(list)
+        for short_code, _, _ in links:
+            codes_by_shard[shard_for(short_code)].append(short_code)
+        destinations = {}
+        for using, codes in codes_by_shard.items():
+            destinations.update(ShortenedURL.objects.using(using).filter(short_code__in=codes)
+                                .values_list('short_code', 'original_url'))
+
+        return TemplateResponse(request, 'admin/shortener/shortenedurl/trending.html', {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Trending links',
+            'window_minutes': settings.TRENDING_WINDOW // 60,
+            'links': [
+                (short_code, destinations.get(short_code, ''), count, error)
+                for short_code, count, error in links
+            ],
+        })
+
+@admin.register(ArchivedURL)
+class ArchivedURLAdmin(RetireOnDeleteMixin, ShardedModelAdmin):
+    list_display = ('short_code', 'original_url', 'clicks', 'last_clicked_at', 'archived_at')
+    list_filter = ('archived_at',)
+    search_fields = ('short_code',)
+    readonly_fields = ('archived_at', 'clicks')
+    ordering = ('-archived_at',)
+
+
+@admin.register(ExpiredURL)
+class ExpiredURLAdmin(ShardedModelAdmin):
+    list_display = ('short_code', 'original_url', 'clicks', 'created_at', 'expired_at')
+    list_filter = ('expired_at',)
+    search_fields = ('short_code',)
+    ordering = ('-expired_at',)
+
+
+@admin.register(LinkHealth)
+class LinkHealthAdmin(ShardedModelAdmin):
+    shard_key_fields = ('url',)
+    list_display = ('url', 'status_code', 'error', 'latency_ms', 'checked_at')
+    list_select_related = ('url',)
+    list_filter = ('status_code', 'checked_at')
+    ordering = ('-checked_at',)
+
+
+@admin.register(APIToken)
+class APITokenAdmin(admin.ModelAdmin):
+    list_display = ('user', 'name', 'created_at', 'last_used_at')
+    list_select_related = ('user',)
+    search_fields = ('user__username', 'name')
+    readonly_fields = ('user', 'key_hash', 'created_at', 'last_used_at')
+    ordering = ('-created_at',)
+
+    def has_add_permission(self, request):
+        # The key is only shown once, by `manage.py create_api_token`
+        return False
@@ -0,0 +1,250 @@
+# shortener/api.py
+"""
+Versioned JSON API for links and their stats.
+
+Requests authenticate with an ``Authorization: Token <key>`` header (see
+APIToken and `manage.py create_api_token`). The views never read the session
+or the user from it, so API traffic causes no session lookups or writes.
+
+Single-link responses carry an ETag and Last-Modified derived from the
+link's version, which changes whenever the link or its click count does;
+clients polling with If-None-Match get an empty 304 after one query. Stats
+responses also take in when the link was last health checked and when its
+visitor sketches were last written. Archived links are read in place rather
+than promoted, so polling them never writes. Lists are paginated with an opaque cursor over (created_at, short_code), which
+stays stable across shards and while new links are being added.
+"""
+import base64
+import json
+from functools import wraps
+
+from django.db.models import Max, Q, Value
+from django.http import HttpResponse, JsonResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date
+from django.views.decorators.csrf import csrf_exempt
+
+from .forms import APILinkForm
+from .models import APIToken, ArchivedURL, ShortenedURL, VisitorSketch
+from .visitors import unique_visitors
+
+LINK_FIELDS = ('short_code', 'original_url', 'created_at', 'expires_at', 'max_clicks', 'clicks', 'last_clicked_at')
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def error_response(status, message, **extra):
+    return JsonResponse({'error': message, **extra}, status=status)
+
+
+def token_required(view):
+    """Authenticate the request with an API token instead of the session"""
+    @csrf_exempt
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        scheme, _, key = request.headers.get('Authorization', '').partition(' ')
+        user = APIToken.authenticate(key.strip()) if scheme.lower() == 'token' and key else None
+        if user is None:
+            response = error_response(401, 'Missing or invalid API token.')
+            response['WWW-Authenticate'] = 'Token'
+            return response
+        request.user = user
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def link_payload(request, link):
+    """JSON representation of a link, from a values() row"""
+    return {
+        **link,
+        'short_url': request.build_absolute_uri(reverse('shortener:redirect', args=[link['short_code']])),
+    }
+
+
+def find_link(short_code):
+    """The ShortenedURL or ArchivedURL with a short code, or None; archived links stay archived"""
+    return ShortenedURL.find(short_code)
+
+
+def conditional_response(request, link, build_payload, changed_at=()):
+    """
+    Answer with 304 if the client's copy of the link is current.
+
+    Args:
+        request: The request, possibly carrying If-None-Match/If-Modified-Since
+        link: ShortenedURL or ArchivedURL the response represents
+        build_payload: Called only when a full response is needed
+        changed_at: When other data in the payload last changed, each a
+            datetime or None if there is none yet
+
+    Returns:
+        JsonResponse or 304 response, with validators and caching headers set
+    """
+    if isinstance(link, ArchivedURL):
+        # Archived rows do not change; a click moves the link to a new hot row
+        validators = [f'a{link.pk}']
+        modified = [link.archived_at]
+    else:
+        validators = [link.pk, link.version]
+        modified = [link.updated_at]
+    for moment in changed_at:
+        validators.append(int(moment.timestamp() * 1000000) if moment else 0)
+        modified.extend([moment] if moment else [])
+    etag = '"{}"'.format('.'.join(map(str, validators)))
+    last_modified = int(max(modified).timestamp())
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = JsonResponse(build_payload())
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # Clients may keep a copy but must revalidate it on every use
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Authorization'])
+    return response
+
+
+def encode_cursor(row):
+    value = f"{row['created_at'].isoformat()}|{row['short_code']}"
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return (created_at, short_code) from a cursor, or None if it is malformed"""
+    try:
+        created_at, short_code = base64.urlsafe_b64decode(cursor.encode()).decode().split('|', 1)
+        created_at = parse_datetime(created_at)
+    except ValueError:
+        return None
+    if created_at is None:
+        return None
+    return created_at, short_code
+
+
+@token_required
+def links(request):
+    if request.method == 'GET':
+        return list_links(request)
+    if request.method == 'POST':
+        return create_link(request)
+    return error_response(405, 'Method not allowed.')
+
+
+def list_links(request):
+    """The user's links, newest first, hot and archived alike"""
+    try:
+        limit = min(max(int(request.GET.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return error_response(400, 'limit must be an integer.')
+
+    after = None
+    if request.GET.get('cursor'):
+        after = decode_cursor(request.GET['cursor'])
+        if after is None:
+            return error_response(400, 'Invalid cursor.')
+
+    # Take a page from every shard and tier, then merge; short codes are
+    # unique across all of them, which makes the order total
+    rows = []
+    for model, archived in ((ShortenedURL, False), (ArchivedURL, True)):
+        for queryset in model.objects.filter(user=request.user).on_shards():
+            if after:
+                created_at, short_code = after
+                queryset = queryset.filter(
+                    Q(created_at__lt=created_at) | Q(created_at=created_at, short_code__lt=short_code)
+                )
+            page = queryset.order_by('-created_at', '-short_code').values(*LINK_FIELDS, archived=Value(archived))
+            rows.extend(page[:limit + 1])
+    rows.sort(key=lambda row: (row['created_at'], row['short_code']), reverse=True)
+
+    page = rows[:limit]
+    response = JsonResponse({
+        'results': [link_payload(request, row) for row in page],
+        'next_cursor': encode_cursor(page[-1]) if len(rows) > limit else None,
+    })
+    patch_vary_headers(response, ['Authorization'])
+    return response
+
+
+def create_link(request):
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return error_response(400, 'Request body must be JSON.')
+    if not isinstance(data, dict):
+        return error_response(400, 'Request body must be a JSON object.')
+
+    form = APILinkForm(data)
+    if not form.is_valid():
+        return error_response(400, 'Invalid link.', fields=form.errors.get_json_data())
+
+    link, created = ShortenedURL.shorten(
+        request.user, form.cleaned_data['url'],
+        custom_code=form.cleaned_data.get('custom_code'),
+        expires_at=form.cleaned_data.get('expires_at'),
+        max_clicks=form.cleaned_data.get('max_clicks')
+    )
+    response = JsonResponse(link_payload(request, {
+        **{name: getattr(link, name) for name in LINK_FIELDS},
+        'archived': False,
+    }), status=201 if created else 200)
+    response['Location'] = reverse('shortener:api_link', args=[link.short_code])
+    return response
+
+
+@token_required
+def link(request, short_code):
+    if request.method not in ('GET', 'HEAD', 'DELETE'):
+        return error_response(405, 'Method not allowed.')
+
+    url_obj = find_link(short_code)
+    if url_obj is None:
+        return error_response(404, 'No link with this short code.')
+
+    if request.method == 'DELETE':
+        if url_obj.user_id != request.user.pk:
+            return error_response(403, 'Only the owner can delete a link.')
+        url_obj.retire()
+        return HttpResponse(status=204)
+
+    return conditional_response(request, url_obj, lambda: link_payload(request, {
+        **{name: getattr(url_obj, name) for name in LINK_FIELDS},
+        'archived': isinstance(url_obj, ArchivedURL),
+    }))
+
+
+@token_required
+def link_stats(request, short_code):
+    if request.method not in ('GET', 'HEAD'):
+        return error_response(405, 'Method not allowed.')
+
+    url_obj = find_link(short_code)
+    if url_obj is None:
+        return error_response(404, 'No link with this short code.')
+
+    # Health checks and visitor counts are written without touching the link
+    health = getattr(url_obj, 'health', None)
+    sketches_written_at = VisitorSketch.objects.for_code(short_code).aggregate(latest=Max('updated_at'))['latest']
+
+    def build_payload():
+        total_visitors, daily_visitors = unique_visitors(short_code)
+        return {
+            'short_code': url_obj.short_code,
+            'clicks': url_obj.clicks,
+            'last_clicked_at': url_obj.last_clicked_at,
+            'unique_visitors': {
+                'total': total_visitors,
+                'daily': [{'day': day, 'visitors': count} for day, count in daily_visitors],
+            },
+            'health': health and {
+                'status_code': health.status_code,
+                'error': health.public_error,
+                'latency_ms': health.latency_ms if health.status_code is not None else None,
+                'checked_at': health.checked_at,
+                'broken': health.is_broken,
+            },
+        }
+
+    return conditional_response(request, url_obj, build_payload,
+                                changed_at=(health and health.checked_at, sketches_written_at))
@@ -1,6 +1,20 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete
 
 
 class ShortenerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shortener'
+
+    def ready(self):
+        from django.contrib.auth.models import User
+
+        from . import search, sharding, snapshot
+        from .models import ShortenedURL
+
+        post_migrate.connect(search.install_search_index, sender=self)
+        post_save.connect(search.index_shortened_url, sender=ShortenedURL)
+        post_delete.connect(search.unindex_shortened_url, sender=ShortenedURL)
+        post_save.connect(snapshot.revoke_saved_link, sender=ShortenedURL)
+        post_delete.connect(snapshot.revoke_deleted_link, sender=ShortenedURL)
+        pre_delete.connect(sharding.delete_user_links, sender=User)
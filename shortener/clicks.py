@@ -0,0 +1,90 @@
+# shortener/clicks.py
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class ClickBuffer:
+    """
+    Accumulate click counts in memory and write them out in batches.
+
+    With a flush interval of 0 every click is written straight away, which
+    matches the behaviour of counting clicks directly in the view. Counts that
+    fail to write are kept for the next flush rather than failing the request
+    that triggered it.
+    """
+
+    def __init__(self, flush_interval=0, sink=None):
+        self.flush_interval = flush_interval
+        self.sink = sink or write_clicks
+        self._counts = Counter()
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def add(self, short_code, count=1):
+        """Count clicks for a short code, flushing if the interval has passed"""
+        with self._lock:
+            self._counts[short_code] += count
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        """Flush if at least flush_interval seconds have passed since the last flush"""
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Hand all pending counts to the sink"""
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            self._last_flush = time.monotonic()
+        if not counts:
+            return
+        try:
+            self.sink(counts)
+        except Exception:
+            # write_clicks drops codes as it writes them, so only the rest is requeued
+            logger.exception('Writing click counts failed; will retry')
+            with self._lock:
+                self._counts.update(counts)
+
+
+def write_clicks(counts):
+    """
+    Apply buffered click counts to the database.
+
+    Codes are removed from ``counts`` as they are written, so if a write
+    fails the mapping holds exactly the clicks still to be written.
+
+    Args:
+        counts: Mapping of short code to number of clicks
+    """
+    from .models import ArchivedURL, ShortenedURL
+
+    now = timezone.now()
+    for short_code, count in list(counts.items()):
+        changes = dict(clicks=F('clicks') + count, last_clicked_at=now, version=F('version') + 1, updated_at=now)
+        if not ShortenedURL.objects.for_code(short_code).update(**changes):
+            # Served from a redirect snapshot after the link was archived;
+            # promote it like a database lookup would have
+            archived = ArchivedURL.objects.for_code(short_code).first()
+            if archived is not None:
+                archived.promote()
+                ShortenedURL.objects.for_code(short_code).update(**changes)
+        del counts[short_code]
+
+
+click_buffer = ClickBuffer(flush_interval=settings.CLICK_FLUSH_INTERVAL)
+atexit.register(click_buffer.flush)
+
+
+def record_click(short_code):
+    """Count one click for a link without a click limit"""
+    click_buffer.add(short_code)
@@ -1,9 +1,5 @@
 # shortener/email_utils.py
 import os
-from mailersend import MailerSendClient, EmailBuilder
-from dotenv import load_dotenv
-
-load_dotenv()
 
 
 def send_password_reset_email(user_email, username, reset_link):
@@ -18,6 +14,13 @@ def send_password_reset_email(user_email, username, reset_link):
     Returns:
         True if email sent successfully, False otherwise
     """
+    # mailersend takes a quarter of a second to import, so it is only
+    # loaded once an email actually has to be sent
+    from dotenv import load_dotenv
+    from mailersend import MailerSendClient, EmailBuilder
+
+    load_dotenv()
+
     try:
         # Get API key from environment
         api_key = os.getenv('MAILERSEND_API_KEY')
@@ -2,7 +2,9 @@
 from django import forms
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
+from django.utils import timezone
 from .models import ShortenedURL, UserProfile
+from .photo_utils import save_profile_photo
 import re
 
 
@@ -24,6 +26,24 @@ class URLForm(forms.Form):
             'placeholder': 'my-custom-code (optional)',
         })
     )
+    expires_at = forms.DateTimeField(
+        label='Expires at (optional)',
+        required=False,
+        input_formats=['%Y-%m-%dT%H:%M'],
+        widget=forms.DateTimeInput(attrs={
+            'class': 'form-control',
+            'type': 'datetime-local',
+        })
+    )
+    max_clicks = forms.IntegerField(
+        label='Maximum clicks (optional)',
+        required=False,
+        min_value=1,
+        widget=forms.NumberInput(attrs={
+            'class': 'form-control',
+            'placeholder': 'Unlimited',
+        })
+    )
 
     def clean_custom_code(self):
         custom_code = self.cleaned_data.get('custom_code')
@@ -36,17 +56,28 @@ class URLForm(forms.Form):
             if len(custom_code) < 3:
                 raise forms.ValidationError('Short code must be at least 3 characters long.')
 
-            # Check if already exists
-            if ShortenedURL.objects.filter(short_code=custom_code).exists():
+            # Check if already exists (or was freed too recently to reuse)
+            if not ShortenedURL.is_code_available(custom_code):
                 raise forms.ValidationError('This short code is already taken. Please choose another.')
 
             # Reserved words
-            reserved = ['admin', 'login', 'logout', 'register', 'my-urls', 'stats', 'api']
+            reserved = ['admin', 'login', 'logout', 'register', 'my-urls', 'stats', 'api', 'qr']
             if custom_code.lower() in reserved:
                 raise forms.ValidationError('This short code is reserved. Please choose another.')
 
         return custom_code
 
+    def clean_expires_at(self):
+        expires_at = self.cleaned_data.get('expires_at')
+        if expires_at and expires_at <= timezone.now():
+            raise forms.ValidationError('Expiry time must be in the future.')
+        return expires_at
+
+
+class APILinkForm(URLForm):
+    """URLForm for the JSON API, which sends expiry times in ISO 8601"""
+    expires_at = forms.DateTimeField(required=False)
+
 
 class UserRegisterForm(UserCreationForm):
     email = forms.EmailField(required=True, widget=forms.EmailInput(attrs={'class': 'form-control'}))
@@ -140,4 +171,23 @@ class ProfilePhotoUpdateForm(forms.ModelForm):
         fields = ['photo']
         widgets = {
             'photo': forms.FileInput(attrs={'class': 'form-control', 'accept': 'image/*'})
-        }
\ No newline at end of file
+        }
+
+    def save(self, commit=True):
+        profile = super().save(commit=False)
+        photo = self.cleaned_data.get('photo')
+        if 'photo' in self.changed_data and photo:
+            # Stored content-addressed; thumbnails are built off the request
+            if commit:
+                save_profile_photo(profile, photo)
+            else:
+                # Like the rest of the form's data, stored when the caller calls save_m2m()
+                save_m2m = self.save_m2m
+
+                def save_photo():
+                    save_m2m()
+                    save_profile_photo(profile, photo)
+                self.save_m2m = save_photo
+        elif commit:
+            profile.save()
+        return profile
\ No newline at end of file
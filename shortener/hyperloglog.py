@@ -0,0 +1,62 @@
+# shortener/hyperloglog.py
+"""
+HyperLogLog cardinality sketch.
+
+A sketch with precision p keeps 2**p one-byte registers (4 KB at the default
+p=12) and estimates the number of distinct 64-bit hashes added to it with a
+standard error of about 1.04 / sqrt(2**p), i.e. ~1.6%. Sketches of the same
+precision merge by taking the register-wise maximum, so per-worker or per-day
+sketches can be combined without double counting.
+"""
+import math
+import zlib
+
+DEFAULT_PRECISION = 12
+HASH_BITS = 64
+
+
+class HyperLogLog:
+    def __init__(self, precision=DEFAULT_PRECISION, registers=None):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(registers or self.size)
+
+    def add(self, value):
+        """
+        Add a 64-bit hash to the sketch.
+
+        Args:
+            value: Uniformly distributed integer in [0, 2**64)
+        """
+        rest_bits = HASH_BITS - self.precision
+        index = value >> rest_bits
+        rest = value & ((1 << rest_bits) - 1)
+        # Position of the leftmost 1-bit in the remaining bits
+        rank = rest_bits - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Fold another sketch of the same precision into this one"""
+        if other.precision != self.precision:
+            raise ValueError('Cannot merge sketches of different precision')
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        """Estimated number of distinct values added"""
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size ** 2 / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.size and zeros:
+            # Small range correction: linear counting is more accurate here
+            estimate = self.size * math.log(self.size / zeros)
+        return round(estimate)
+
+    def to_bytes(self):
+        """Compact serialized form; mostly empty sketches compress to a few bytes"""
+        return bytes([self.precision]) + zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data)
+        return cls(precision=data[0], registers=zlib.decompress(data[1:]))
@@ -1,6 +1,5 @@
 # shortener/identicon_utils.py
 import hashlib
-from PIL import Image, ImageDraw
 from io import BytesIO
 
 
@@ -16,6 +15,9 @@ def generate_identicon(text, size=5, pixel_size=50):
     Returns:
         PIL Image object
     """
+    # Pillow is imported on first use to keep it out of worker startup
+    from PIL import Image, ImageDraw
+
     # Generate hash from text
     hash_value = hashlib.md5(text.encode()).hexdigest()
 
@@ -0,0 +1,171 @@
+# shortener/link_checker.py
+"""
+Concurrent destination health checks.
+
+Checks run on asyncio with a global cap on open connections and a smaller
+cap per host, so one slow or rate-limiting site cannot stall the batch or
+get hammered. Requests are plain HTTP/1.1 over asyncio streams: a HEAD,
+retried as GET when the server does not support HEAD, following up to
+MAX_REDIRECTS redirects.
+
+The timeout and the recorded latency cover only time spent on the network,
+not time queued behind the connection limits, so a long queue for one host
+does not make its links look slow or broken.
+
+Destinations are user supplied, so every host (including redirect targets)
+is resolved first and only public addresses are connected to, unless
+allow_private_addresses is set. The connection goes to the address that was
+checked, not to a second lookup of the name.
+"""
+import asyncio
+import ipaddress
+import socket
+import ssl
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Optional
+from urllib.parse import urljoin, urlsplit
+
+MAX_REDIRECTS = 5
+USER_AGENT = 'url-shortener-link-checker/1.0'
+
+
+@dataclass
+class CheckResult:
+    key: object
+    status_code: Optional[int]
+    latency_ms: int
+    error: str = ''
+
+
+class RefusedAddress(ValueError):
+    """The destination resolves to an address the checker may not connect to"""
+
+
+@dataclass
+class Stopwatch:
+    """Network time spent so far on one link, across its redirects"""
+    elapsed: float = 0.0
+
+
+class LinkChecker:
+    def __init__(self, concurrency=50, per_host=4, timeout=10.0, allow_private_addresses=False):
+        self.timeout = timeout
+        self.per_host = per_host
+        self.allow_private_addresses = allow_private_addresses
+        self._connections = asyncio.Semaphore(concurrency)
+        self._hosts = defaultdict(lambda: asyncio.Semaphore(self.per_host))
+        self._ssl_context = ssl.create_default_context()
+
+    async def check_many(self, items):
+        """
+        Check a batch of destinations concurrently.
+
+        Args:
+            items: Iterable of (key, url) pairs; the key is passed through
+
+        Returns:
+            List of CheckResult, in input order
+        """
+        return await asyncio.gather(*(self.check(key, url) for key, url in items))
+
+    async def check(self, key, url):
+        stopwatch = Stopwatch()
+        try:
+            status_code = await self._follow(url, stopwatch)
+            error = ''
+        except asyncio.TimeoutError:
+            status_code, error = None, 'Timed out'
+        except (OSError, ValueError, ssl.SSLError) as e:
+            status_code, error = None, (str(e) or e.__class__.__name__)[:255]
+        return CheckResult(key, status_code, int(stopwatch.elapsed * 1000), error)
+
+    async def _follow(self, url, stopwatch):
+        for _ in range(MAX_REDIRECTS + 1):
+            status_code, location = await self._request('HEAD', url, stopwatch)
+            if status_code in (405, 501):
+                status_code, location = await self._request('GET', url, stopwatch)
+            if not (300 <= status_code < 400 and location):
+                return status_code
+            url = urljoin(url, location)
+        raise ValueError('Too many redirects')
+
+    async def _request(self, method, url, stopwatch):
+        """Send one request and return (status code, Location header or None)"""
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError(f'Unsupported URL: {url}')
+
+        async with self._hosts[parts.hostname], self._connections:
+            # Only now, holding a connection slot, does the clock run
+            started = time.perf_counter()
+            try:
+                return await asyncio.wait_for(self._exchange(method, parts), self.timeout - stopwatch.elapsed)
+            finally:
+                stopwatch.elapsed += time.perf_counter() - started
+
+    async def _resolve(self, host, port):
+        """Return an address to connect to, raising RefusedAddress for non-public ones"""
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        addresses = [info[4][0] for info in infos]
+        if not self.allow_private_addresses:
+            for address in addresses:
+                ip = ipaddress.ip_address(address.split('%', 1)[0])
+                if not ip.is_global or ip.is_multicast:
+                    raise RefusedAddress(f'Refused to connect to non-public address {address}')
+        return addresses[0]
+
+    async def _exchange(self, method, parts):
+        secure = parts.scheme == 'https'
+        port = parts.port or (443 if secure else 80)
+        path = parts.path or '/'
+        if parts.query:
+            path = f'{path}?{parts.query}'
+
+        address = await self._resolve(parts.hostname, port)
+        reader, writer = await asyncio.open_connection(
+            address, port,
+            ssl=self._ssl_context if secure else None,
+            server_hostname=parts.hostname if secure else None,
+        )
+        try:
+            request = (
+                f'{method} {path} HTTP/1.1\r\n'
+                f'Host: {parts.netloc.rsplit("@", 1)[-1]}\r\n'
+                f'User-Agent: {USER_AGENT}\r\n'
+                f'Accept: */*\r\n'
+                f'Connection: close\r\n\r\n'
+            )
+            writer.write(request.encode('latin-1'))
+            await writer.drain()
+            status_line = await reader.readline()
+            try:
+                status_code = int(status_line.split()[1])
+            except (IndexError, ValueError):
+                raise ValueError('Malformed HTTP response')
+            location = None
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.strip().lower() == 'location':
+                    location = value.strip()
+            # The body is never read; Connection: close lets us just hang up
+            return status_code, location
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (OSError, ssl.SSLError):
+                pass
+
+
+def check_links(items, concurrency=50, per_host=4, timeout=10.0, allow_private_addresses=False):
+    """Synchronous wrapper around LinkChecker.check_many"""
+    async def run():
+        checker = LinkChecker(concurrency=concurrency, per_host=per_host, timeout=timeout,
+                              allow_private_addresses=allow_private_addresses)
+        return await checker.check_many(items)
+    return asyncio.run(run())
@@ -0,0 +1,72 @@
+# shortener/management/commands/bench_sessions.py
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment, \
+    teardown_test_environment
+
+from shortener.sessions import flush_pending
+
+CONFIGURATIONS = [
+    ('database (before)', {
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.db',
+        'MESSAGE_STORAGE': 'django.contrib.messages.storage.fallback.FallbackStorage',
+    }),
+    ('write-behind cache', {
+        'SESSION_ENGINE': 'shortener.sessions',
+    }),
+    ('signed cookies', {
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.signed_cookies',
+    }),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure login and my_urls request throughput, and session table '
+        'queries per request, for each session configuration. Runs against '
+        'a throwaway test database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=50, help='Login requests per configuration')
+        parser.add_argument('--requests', type=int, default=500, help='my_urls requests per configuration')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            # A fast hasher keeps password checks from drowning out session costs
+            with override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher']):
+                User.objects.create_user('bench', 'bench@example.com', 'bench-password')
+                self.stdout.write(f"{'configuration':<22}{'login req/s':>14}{'my_urls req/s':>16}{'session queries/req':>22}")
+                for label, overrides in CONFIGURATIONS:
+                    with override_settings(**overrides):
+                        login_rate, _ = self.measure(self.login, options['logins'])
+                        client = self.login()
+                        urls_rate, session_queries = self.measure(lambda: client.get('/my-urls/'),
+                                                                  options['requests'])
+                    self.stdout.write(f'{label:<22}{login_rate:>14.1f}{urls_rate:>16.1f}{session_queries:>22.2f}')
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def login(self):
+        client = Client()
+        response = client.post('/login/', {'username': 'bench', 'password': 'bench-password'})
+        assert response.status_code == 302, 'benchmark login failed'
+        return client
+
+    def measure(self, request, count):
+        """Run a request count times, returning (requests/s, session queries per request)"""
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            for _ in range(count):
+                request()
+            flush_pending()
+            elapsed = time.perf_counter() - started
+        session_queries = sum('django_session' in query['sql'] for query in queries.captured_queries)
+        return count / elapsed, session_queries / count
@@ -0,0 +1,87 @@
+# shortener/management/commands/check_links.py
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from shortener.link_checker import check_links
+from shortener.models import LinkHealth, ShortenedURL
+from shortener.sharding import shard_aliases
+
+
+class Command(BaseCommand):
+    help = (
+        'Check that link destinations still respond, recording status, '
+        'latency and check time per link. With --interval it keeps running '
+        'and re-checks links as their last result goes stale.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Links loaded and checked per round (default: 500)')
+        parser.add_argument('--concurrency', type=int, default=50,
+                            help='Maximum open connections (default: 50)')
+        parser.add_argument('--per-host', type=int, default=4,
+                            help='Maximum open connections per host (default: 4)')
+        parser.add_argument('--timeout', type=float, default=10.0,
+                            help='Seconds allowed per link, redirects included (default: 10)')
+        parser.add_argument('--stale-hours', type=float, default=24,
+                            help='Skip links checked within this many hours (default: 24)')
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Run again every N seconds instead of exiting')
+
+    def handle(self, *args, **options):
+        while True:
+            checked, broken = self.run_once(options)
+            self.stdout.write(self.style.SUCCESS(f'Checked {checked} link(s), {broken} broken.'))
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
+
+    def run_once(self, options):
+        checked = broken = 0
+        for using in shard_aliases():
+            shard_checked, shard_broken = self.check_shard(using, options)
+            checked += shard_checked
+            broken += shard_broken
+        return checked, broken
+
+    def check_shard(self, using, options):
+        cutoff = timezone.now() - timedelta(hours=options['stale_hours'])
+        due = (ShortenedURL.objects.using(using)
+               .filter(Q(health__isnull=True) | Q(health__checked_at__lt=cutoff))
+               .order_by('pk'))
+
+        checked = broken = 0
+        last_pk = 0
+        while True:
+            # Keyset pagination keeps each chunk query cheap on large tables
+            chunk = list(due.filter(pk__gt=last_pk).values_list('pk', 'original_url')[:options['chunk_size']])
+            if not chunk:
+                return checked, broken
+            last_pk = chunk[-1][0]
+
+            results = check_links(
+                chunk,
+                concurrency=options['concurrency'],
+                per_host=options['per_host'],
+                timeout=options['timeout'],
+                allow_private_addresses=settings.LINK_CHECK_ALLOW_PRIVATE_ADDRESSES,
+            )
+            now = timezone.now()
+            rows = [
+                LinkHealth(url_id=result.key, status_code=result.status_code, error=result.error,
+                           latency_ms=result.latency_ms, checked_at=now)
+                for result in results
+            ]
+            LinkHealth.objects.using(using).bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=['url'],
+                update_fields=['status_code', 'error', 'latency_ms', 'checked_at'],
+            )
+            checked += len(rows)
+            broken += sum(row.is_broken for row in rows)
@@ -0,0 +1,30 @@
+# shortener/management/commands/create_api_token.py
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from shortener.models import APIToken
+
+
+class Command(BaseCommand):
+    help = (
+        'Create an API token for a user. Only a hash of the key is stored, so '
+        'the key is printed once and cannot be shown again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='User the token authenticates as')
+        parser.add_argument('--name', default='',
+                            help='Label to tell the user\'s tokens apart (e.g. "CI")')
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        try:
+            user = User.objects.get(**{User.USERNAME_FIELD: options['username']})
+        except User.DoesNotExist:
+            raise CommandError(f'No user named "{options["username"]}".')
+
+        token, key = APIToken.create_for_user(user, name=options['name'])
+        self.stdout.write(key)
+        self.stdout.write(self.style.SUCCESS(
+            f'Created API token #{token.pk} for {user}. Send it as "Authorization: Token <key>".'
+        ))
@@ -0,0 +1,56 @@
+# shortener/management/commands/pregenerate_qr_codes.py
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from shortener.models import ShortenedURL
+from shortener.qr_utils import CONTENT_TYPES, ERROR_CORRECTION_LEVELS, pregenerate_qr_codes
+
+
+class Command(BaseCommand):
+    help = (
+        'Render QR codes for existing links into the QR cache ahead of time, '
+        'e.g. right after a bulk import.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', required=True,
+                            help='Public origin of the short links, e.g. https://sho.rt')
+        parser.add_argument('--codes', nargs='*', default=None,
+                            help='Only these short codes')
+        parser.add_argument('--user', help='Only links owned by this username')
+        parser.add_argument('--since-days', type=int,
+                            help='Only links created in the last N days')
+        parser.add_argument('--format', nargs='+', choices=sorted(CONTENT_TYPES), default=['png'],
+                            dest='formats')
+        parser.add_argument('--size', type=int, default=10, help='Pixels per module (default: 10)')
+        parser.add_argument('--error-correction', choices=sorted(ERROR_CORRECTION_LEVELS), default='M')
+
+    def handle(self, *args, **options):
+        links = ShortenedURL.objects.all()
+        if options['codes']:
+            links = links.filter(short_code__in=options['codes'])
+        if options['user']:
+            # Users live on the default database, which links may not share
+            user_id = User.objects.filter(username=options['user']).values_list('pk', flat=True).first()
+            if user_id is None:
+                raise CommandError(f'No user named "{options["user"]}".')
+            links = links.filter(user_id=user_id)
+        if options['since_days'] is not None:
+            links = links.filter(created_at__gte=timezone.now() - timedelta(days=options['since_days']))
+
+        base_url = options['base_url'].rstrip('/')
+        short_urls = (
+            f'{base_url}/{code}'
+            for queryset in links.values_list('short_code', flat=True).on_shards()
+            for code in queryset.iterator(chunk_size=2000)
+        )
+        rendered = pregenerate_qr_codes(
+            short_urls,
+            formats=options['formats'],
+            box_size=options['size'],
+            error_correction=options['error_correction'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Rendered {rendered} QR code(s).'))
@@ -0,0 +1,37 @@
+# shortener/management/commands/process_profile_photos.py
+from django.core.management.base import BaseCommand
+
+from shortener.models import UserProfile
+from shortener.photo_utils import process_profile_photo
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate thumbnails for uploaded profile photos that are not ready, '
+        'such as uploads queued when the server stopped or whose processing '
+        'failed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--failed-only', action='store_true',
+                            help='Only retry photos whose processing failed')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report how many photos would be processed')
+
+    def handle(self, *args, **options):
+        pending = UserProfile.objects.exclude(photo_hash='').filter(photo_thumbnails_ready=False)
+        if options['failed_only']:
+            pending = pending.filter(photo_processing_failed=True)
+
+        if options['dry_run']:
+            self.stdout.write(f'{pending.count()} profile photo(s) would be processed.')
+            return
+
+        processed = failed = 0
+        for profile in pending.iterator():
+            if process_profile_photo(profile.pk, profile.photo_hash, profile.photo.name):
+                processed += 1
+            else:
+                failed += 1
+                self.stderr.write(f'Processing the photo of user {profile.user_id} failed.')
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} profile photo(s), {failed} failed.'))
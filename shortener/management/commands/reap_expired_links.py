@@ -0,0 +1,75 @@
+# shortener/management/commands/reap_expired_links.py
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from shortener.models import ShortenedURL, ArchivedURL, ExpiredURL, VisitorSketch
+from shortener.sharding import shard_aliases
+
+
+class Command(BaseCommand):
+    help = (
+        'Move expired links out of the ShortenedURL and ArchivedURL tables '
+        'into the ExpiredURL archive, in bounded batches.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Rows moved per transaction (default: 500)')
+        parser.add_argument('--max-batches', type=int, default=0,
+                            help='Stop after this many batches, 0 for no limit')
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help='Seconds to pause between batches')
+        parser.add_argument('--purge', action='store_true',
+                            help='Also delete archived rows whose quarantine has ended and '
+                                 'daily visitor sketches past retention')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        max_batches = options['max_batches']
+        now = timezone.now()
+
+        reaped = batches = 0
+        for using in shard_aliases():
+            for model in (ShortenedURL, ArchivedURL):
+                while not max_batches or batches < max_batches:
+                    moved = self.reap_batch(model, using, now, batch_size)
+                    if not moved:
+                        break
+                    reaped += moved
+                    batches += 1
+                    if options['sleep']:
+                        time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {reaped} expired link(s) in {batches} batch(es).'))
+
+        if options['purge']:
+            purged = sum(self.purge_archive(using, now, batch_size) for using in shard_aliases())
+            self.stdout.write(self.style.SUCCESS(f'Purged {purged} archived link(s) past quarantine.'))
+            purged = sum(VisitorSketch.objects.using(using).stale(now).delete()[0] for using in shard_aliases())
+            self.stdout.write(self.style.SUCCESS(f'Purged {purged} daily visitor sketch(es) past retention.'))
+
+    def reap_batch(self, model, using, now, batch_size):
+        """Archive and delete one batch of expired links, returning how many moved"""
+        links = model.objects.using(using)
+        ids = list(links.expired(now).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return 0
+        with transaction.atomic(using=using):
+            rows = list(links.select_for_update().filter(pk__in=ids).expired(now))
+            ExpiredURL.objects.using(using).bulk_create([ExpiredURL.from_shortened_url(row, now) for row in rows])
+            links.filter(pk__in=[row.pk for row in rows]).delete()
+            # The code may be handed out again, so its visitor counts go too
+            VisitorSketch.objects.using(using).filter(short_code__in=[row.short_code for row in rows]).delete()
+        return len(rows)
+
+    def purge_archive(self, using, now, batch_size):
+        """Delete archive rows in batches once their codes may be recycled"""
+        archive = ExpiredURL.objects.using(using)
+        purged = 0
+        while True:
+            ids = list(archive.released(now).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                return purged
+            purged += archive.filter(pk__in=ids).delete()[0]
@@ -0,0 +1,79 @@
+# shortener/management/commands/rebalance_shards.py
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shortener.models import ArchivedURL, ExpiredURL, LinkHealth, ShortenedURL, VisitorSketch
+from shortener.sharding import shard_aliases, shard_for
+
+
+def copy_fields(instance, exclude=()):
+    """Concrete field values of a row, without its primary key"""
+    return {
+        field.attname: getattr(instance, field.attname)
+        for field in instance._meta.concrete_fields
+        if not field.primary_key and field.attname not in exclude
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Move link rows that live on the wrong shard (e.g. after adding a '
+        'database to SHORTENER_SHARDS) to the shard their short code hashes to.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Rows moved per transaction (default: 500)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report how many rows would move')
+
+    def handle(self, *args, **options):
+        for model, move in ((ShortenedURL, self.move_links),
+                            (ArchivedURL, self.move_rows),
+                            (ExpiredURL, self.move_rows),
+                            (VisitorSketch, self.move_rows)):
+            total = 0
+            for source in shard_aliases():
+                misplaced = defaultdict(list)
+                rows = model.objects.using(source).values_list('pk', 'short_code').iterator(chunk_size=5000)
+                for pk, short_code in rows:
+                    target = shard_for(short_code)
+                    if target != source:
+                        misplaced[target].append(pk)
+
+                for target, pks in misplaced.items():
+                    total += len(pks)
+                    if options['dry_run']:
+                        continue
+                    for start in range(0, len(pks), options['batch_size']):
+                        move(model, source, target, pks[start:start + options['batch_size']])
+
+            verb = 'would move' if options['dry_run'] else 'moved'
+            self.stdout.write(self.style.SUCCESS(f'{model.__name__}: {verb} {total} row(s).'))
+
+    def move_links(self, model, source, target, pks):
+        """Move hot links together with their health records"""
+        with transaction.atomic(using=source), transaction.atomic(using=target):
+            rows = ShortenedURL.objects.using(source).filter(pk__in=pks).select_related('health')
+            for row in rows:
+                # Skip rows already copied by an interrupted earlier run
+                if ShortenedURL.objects.using(target).filter(short_code=row.short_code).exists():
+                    continue
+                moved = ShortenedURL.restore(target, **copy_fields(row))
+                try:
+                    health = row.health
+                except LinkHealth.DoesNotExist:
+                    continue
+                LinkHealth.objects.using(target).create(url_id=moved.pk, **copy_fields(health, exclude=('url_id',)))
+            ShortenedURL.objects.using(source).filter(pk__in=pks).delete()
+
+    def move_rows(self, model, source, target, pks):
+        """Move rows that carry no dependent tables"""
+        with transaction.atomic(using=source), transaction.atomic(using=target):
+            rows = model.objects.using(source).filter(pk__in=pks)
+            # Conflicts are rows already copied by an interrupted earlier run
+            model.objects.using(target).bulk_create([model(**copy_fields(row)) for row in rows],
+                                                    ignore_conflicts=True)
+            model.objects.using(source).filter(pk__in=pks).delete()
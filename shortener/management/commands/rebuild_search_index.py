@@ -0,0 +1,24 @@
+# shortener/management/commands/rebuild_search_index.py
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from shortener.models import ShortenedURL
+from shortener.search import get_backend
+from shortener.sharding import shard_aliases
+
+
+class Command(BaseCommand):
+    help = 'Create the link search index if needed and refill it from ShortenedURL.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', help='Only rebuild this database (default: every shard)')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Rows indexed per insert (default: 5000)')
+
+    def handle(self, *args, **options):
+        for using in [options['database']] if options['database'] else shard_aliases():
+            backend = get_backend(using)
+            backend.install(connections[using])
+            with transaction.atomic(using=using):
+                indexed = backend.rebuild(ShortenedURL.objects.all(), using, options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} link(s) in {using}.'))
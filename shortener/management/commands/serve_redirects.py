@@ -0,0 +1,42 @@
+# shortener/management/commands/serve_redirects.py
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shortener.prefork import PreforkServer
+
+
+class Command(BaseCommand):
+    help = (
+        'Serve the site from N pre-forked worker processes that share the '
+        'redirect snapshot and send click counts to a single flusher process. '
+        'Send SIGHUP to reload workers and SIGUSR1 to print per-worker stats.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8000)
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Number of worker processes (default: CPU count)')
+        parser.add_argument('--flush-interval', type=float, default=1.0,
+                            help='Seconds between click count flushes (default: 1)')
+        parser.add_argument('--stats-interval', type=float, default=0,
+                            help='Print worker stats every N seconds, 0 to disable')
+
+    def handle(self, *args, **options):
+        if not hasattr(os, 'fork'):
+            raise CommandError('serve_redirects needs a platform with fork().')
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1.')
+        if options['flush_interval'] <= 0:
+            raise CommandError('--flush-interval must be positive.')
+
+        server = PreforkServer(
+            host=options['host'],
+            port=options['port'],
+            workers=options['workers'],
+            flush_interval=options['flush_interval'],
+            stats_interval=options['stats_interval'],
+            log=self.stdout.write,
+        )
+        server.run()
@@ -0,0 +1,99 @@
+# shortener/management/commands/startup_profile.py
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Run in a fresh interpreter: boot Django the way a WSGI worker does and
+# serve one request, printing the wall-clock time at the end of each phase
+CHILD_SCRIPT = '''
+import json, sys, time
+marks = [("interpreter start", time.time())]
+import django
+django.setup()
+marks.append(("django.setup()", time.time()))
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+marks.append(("WSGI handler", time.time()))
+from django.urls import get_resolver
+get_resolver().url_patterns
+marks.append(("URLconf and views", time.time()))
+from wsgiref.util import setup_testing_defaults
+environ = {"PATH_INFO": sys.argv[1]}
+setup_testing_defaults(environ)
+statuses = []
+b"".join(application(environ, lambda status, headers, exc_info=None: statuses.append(status)))
+marks.append(("first request", time.time()))
+print(json.dumps({"marks": marks, "status": statuses[0]}))
+'''
+IMPORT_TIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| *(\S+)$')
+
+
+class Command(BaseCommand):
+    help = (
+        'Report per-module import cost (python -X importtime) and '
+        'time-to-first-request for a freshly started worker process.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/',
+                            help='Path of the first request (default: /)')
+        parser.add_argument('--runs', type=int, default=5,
+                            help='Worker starts to time; the median is reported (default: 5)')
+        parser.add_argument('--limit', type=int, default=20,
+                            help='Number of slowest modules to list (default: 20)')
+
+    def handle(self, *args, **options):
+        runs = [self.run_child(options['path']) for _ in range(options['runs'])]
+
+        self.stdout.write(f"{'slowest imports':<50}{'self ms':>10}{'total ms':>10}")
+        imports = sorted(self.import_times(options['path']), key=lambda row: row[1], reverse=True)
+        for name, self_us, total_us in imports[:options['limit']]:
+            self.stdout.write(f'{name:<50}{self_us / 1000:>10.1f}{total_us / 1000:>10.1f}')
+        self.stdout.write('Modules Django loads with import_module() (apps, models, URLconf) are '
+                          'not listed; their cost shows up in the phases below.')
+
+        self.stdout.write('')
+        self.stdout.write(f"{'startup phase':<50}{'ms':>10}")
+        for index, (phase, _) in enumerate(runs[0][0]):
+            duration = statistics.median(phases[index][1] for phases, _ in runs)
+            self.stdout.write(f'{phase:<50}{duration:>10.1f}')
+
+        total = statistics.median(sum(duration for _, duration in phases) for phases, _ in runs)
+        self.stdout.write(self.style.SUCCESS(
+            f'First request to {options["path"]} answered ({runs[-1][1]}) {total:.0f} ms after '
+            f'process start (median of {len(runs)} run(s)).'
+        ))
+
+    def spawn(self, path, *interpreter_options):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'project.settings')}
+        return subprocess.run(
+            [sys.executable, *interpreter_options, '-c', CHILD_SCRIPT, path],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+        )
+
+    def run_child(self, path):
+        """Start a worker, returning ([(phase, ms)], status of the first response)"""
+        started = time.time()
+        result = json.loads(self.spawn(path).stdout.splitlines()[-1])
+        phases = []
+        for phase, finished in result['marks']:
+            phases.append((phase, (finished - started) * 1000))
+            started = finished
+        return phases, result['status']
+
+    def import_times(self, path):
+        """Parse -X importtime output into (module, self us, cumulative us) rows"""
+        rows = []
+        for line in self.spawn(path, '-X', 'importtime').stderr.splitlines():
+            match = IMPORT_TIME_RE.match(line)
+            if match:
+                self_us, total_us, name = match.groups()
+                rows.append((name, int(self_us), int(total_us)))
+        return rows
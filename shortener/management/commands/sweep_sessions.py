@@ -0,0 +1,25 @@
+# shortener/management/commands/sweep_sessions.py
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shortener.sessions import SessionStore, flush_pending
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete expired sessions from the database in small batches, so the '
+        'sweep never holds a long lock on the session table.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Sessions deleted per statement (default: 1000)')
+
+    def handle(self, *args, **options):
+        if settings.SESSION_ENGINE == 'django.contrib.sessions.backends.signed_cookies':
+            self.stdout.write('Signed-cookie sessions are not stored server-side; nothing to sweep.')
+            return
+
+        flush_pending()
+        deleted = SessionStore.clear_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired session(s).'))
@@ -0,0 +1,74 @@
+# shortener/management/commands/tier_links.py
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from shortener.models import ShortenedURL, ArchivedURL
+
+
+class Command(BaseCommand):
+    help = (
+        'Move links that have been idle past a threshold from the hot '
+        'ShortenedURL table into the ArchivedURL table. Safe to run '
+        'repeatedly; each run picks up where the previous one stopped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--idle-days', type=int, default=settings.LINK_ARCHIVE_IDLE_DAYS,
+                            help='Archive links not clicked for this many days')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Rows moved per transaction (default: 500)')
+        parser.add_argument('--max-batches', type=int, default=0,
+                            help='Stop after this many batches, 0 for no limit')
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help='Seconds to pause between batches')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report how many links would be archived')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        cutoff = now - timedelta(days=options['idle_days'])
+        # Only links never clicked are judged by their creation time. Links
+        # clicked before last_clicked_at was recorded have no idle time to go
+        # by, so they get one starting now (below) rather than being archived
+        idle = ShortenedURL.objects.filter(
+            Q(last_clicked_at__lt=cutoff) |
+            Q(last_clicked_at__isnull=True, clicks=0, created_at__lt=cutoff)
+        )
+
+        if options['dry_run']:
+            count = sum(queryset.count() for queryset in idle.on_shards())
+            self.stdout.write(f'{count} link(s) idle since {cutoff:%Y-%m-%d} would be archived.')
+            return
+
+        untracked = ShortenedURL.objects.filter(last_clicked_at__isnull=True, clicks__gt=0)
+        backfilled = sum(
+            queryset.update(last_clicked_at=now, version=F('version') + 1, updated_at=now)
+            for queryset in untracked.on_shards()
+        )
+        if backfilled:
+            self.stdout.write(f'Started the idle clock of {backfilled} link(s) clicked before it was tracked.')
+
+        moved = batches = 0
+        for queryset in idle.on_shards():
+            while not options['max_batches'] or batches < options['max_batches']:
+                ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:options['batch_size']])
+                if not ids:
+                    break
+                with transaction.atomic(using=queryset.db):
+                    rows = list(queryset.select_for_update().filter(pk__in=ids))
+                    ArchivedURL.objects.using(queryset.db).bulk_create(
+                        [ArchivedURL.from_shortened_url(row, now) for row in rows]
+                    )
+                    ShortenedURL.objects.using(queryset.db).filter(pk__in=[row.pk for row in rows]).delete()
+                moved += len(rows)
+                batches += 1
+                if options['sleep']:
+                    time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(f'Archived {moved} idle link(s) in {batches} batch(es).'))
@@ -1,21 +1,51 @@
 # shortener/models.py
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Q
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
 from django.utils import timezone
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from datetime import timedelta
+from datetime import date, timedelta
+import hashlib
 import string
 import random
 import secrets
 
+from .clicks import record_click
+from .hyperloglog import HyperLogLog
+from .sharding import ShardedQuerySet, shard_for
+from .snapshot import revoke_codes
+
+
+class ShortenedURLQuerySet(ShardedQuerySet):
+    def expired(self, now=None):
+        """Links past their expiry time or click limit"""
+        now = now or timezone.now()
+        return self.filter(
+            Q(expires_at__lte=now) |
+            Q(max_clicks__isnull=False, clicks__gte=F('max_clicks'))
+        )
+
 
 class ShortenedURL(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='shortened_urls')
+    # No database constraint or ORM cascade: with sharding, links and users live in
+    # different databases, so sharding.delete_user_links cleans up when a user is deleted
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, null=True, blank=True, related_name='shortened_urls',
+                             db_constraint=False)
     original_url = models.URLField(max_length=2048)
     short_code = models.CharField(max_length=10, unique=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     clicks = models.IntegerField(default=0)
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    max_clicks = models.PositiveIntegerField(null=True, blank=True)
+    last_clicked_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Bumped on every change, click counts included; the API's ETag
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    objects = ShortenedURLQuerySet.as_manager()
 
     class Meta:
         ordering = ['-created_at']
@@ -23,15 +53,351 @@ class ShortenedURL(models.Model):
     def __str__(self):
         return f"{self.short_code} -> {self.original_url}"
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            self.version += 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version', 'updated_at'}
+        super().save(*args, **kwargs)
+
+    def is_expired(self, now=None):
+        """Check if the link has passed its expiry time or click limit"""
+        if self.expires_at is not None and (now or timezone.now()) >= self.expires_at:
+            return True
+        return self.max_clicks is not None and self.clicks >= self.max_clicks
+
+    def register_click(self):
+        """
+        Count a click against this link.
+
+        Unlimited links go through the shared click buffer. Links with a click
+        limit are incremented with a conditional UPDATE so concurrent requests
+        can never push them past ``max_clicks``.
+
+        Returns:
+            True if the click was counted, False if the limit was already reached
+        """
+        now = timezone.now()
+        if self.max_clicks is None:
+            record_click(self.short_code)
+        elif not ShortenedURL.objects.using(self._state.db).filter(pk=self.pk, clicks__lt=self.max_clicks).update(
+                clicks=F('clicks') + 1, last_clicked_at=now, version=F('version') + 1, updated_at=now):
+            return False
+        self.clicks += 1
+        self.last_clicked_at = now
+        return True
+
+    @classmethod
+    def shorten(cls, user, original_url, custom_code=None, expires_at=None, max_clicks=None):
+        """
+        Create a link, or reuse the user's existing permanent link to the same URL.
+
+        Args:
+            user: Owner of the link
+            original_url: Destination URL
+            custom_code: Short code chosen by the user; always creates a new link
+            expires_at: Optional expiry time
+            max_clicks: Optional click limit
+
+        Returns:
+            Tuple of (ShortenedURL, created)
+        """
+        if not custom_code and expires_at is None and max_clicks is None:
+            candidates = cls.objects.filter(
+                original_url=original_url,
+                user=user,
+                expires_at__isnull=True,
+                max_clicks__isnull=True
+            )
+            for queryset in candidates.on_shards():
+                existing = queryset.first()
+                if existing:
+                    return existing, False
+
+        return cls.objects.create(
+            original_url=original_url,
+            short_code=custom_code or cls.generate_short_code(),
+            user=user,
+            expires_at=expires_at,
+            max_clicks=max_clicks
+        ), True
+
+    def retire(self):
+        """Delete this link, holding its code in quarantine like an expired one"""
+        using = self._state.db
+        with transaction.atomic(using=using):
+            ExpiredURL.from_shortened_url(self).save(using=using)
+            VisitorSketch.objects.using(using).filter(short_code=self.short_code).delete()
+            self.delete()
+
+    @classmethod
+    def restore(cls, using, **fields):
+        """
+        Re-create a link moved in from another table or database.
+
+        created_at is written in a second step because auto_now_add would
+        otherwise replace it with the current time.
+        """
+        url_obj = cls(**fields)
+        url_obj.save(using=using)
+        cls.objects.using(using).filter(pk=url_obj.pk).update(created_at=fields['created_at'])
+        url_obj.created_at = fields['created_at']
+        return url_obj
+
+    @classmethod
+    def resolve(cls, short_code):
+        """
+        Look up a link by code, promoting it back from the archive if needed.
+
+        Args:
+            short_code: The short code to resolve
+
+        Returns:
+            ShortenedURL instance
+
+        Raises:
+            ShortenedURL.DoesNotExist: if the code is in neither tier
+        """
+        try:
+            return cls.objects.for_code(short_code).get()
+        except cls.DoesNotExist:
+            archived = ArchivedURL.objects.for_code(short_code).first()
+            if archived is None:
+                raise
+            return archived.promote()
+
+    @classmethod
+    def find(cls, short_code):
+        """
+        Look up a link by code in either tier, leaving archived links archived.
+
+        For pages and API reads that may be polled; only a click should
+        promote a link, as ``resolve`` does.
+
+        Returns:
+            ShortenedURL or ArchivedURL instance, or None
+        """
+        return cls.objects.for_code(short_code).first() or ArchivedURL.objects.for_code(short_code).first()
+
+    @staticmethod
+    def is_code_available(code):
+        """Check that a code is neither in use nor held in quarantine"""
+        if ShortenedURL.objects.for_code(code).exists():
+            return False
+        if ArchivedURL.objects.for_code(code).exists():
+            return False
+        return not ExpiredURL.objects.quarantined().for_code(code).exists()
+
     @staticmethod
     def generate_short_code(length=6):
         chars = string.ascii_letters + string.digits
         while True:
             code = ''.join(random.choice(chars) for _ in range(length))
-            if not ShortenedURL.objects.filter(short_code=code).exists():
+            if ShortenedURL.is_code_available(code):
                 return code
 
 
+class LinkHealth(models.Model):
+    """Result of the most recent destination check for a link"""
+    url = models.OneToOneField(ShortenedURL, on_delete=models.CASCADE, primary_key=True, related_name='health')
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    error = models.CharField(max_length=255, blank=True)
+    latency_ms = models.PositiveIntegerField(null=True, blank=True)
+    checked_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.url_id}: {self.status_code or self.error}"
+
+    @property
+    def is_broken(self):
+        """Unreachable destinations and 4xx/5xx responses count as broken"""
+        return self.status_code is None or self.status_code >= 400
+
+    @property
+    def public_error(self):
+        """
+        Error to show the link's owner.
+
+        The recorded error is the checker's own (socket errors, refused
+        addresses) and can tell a user about the network it runs on, so
+        owners only learn that the destination could not be reached.
+        """
+        return 'Unreachable' if self.status_code is None else ''
+
+
+class ArchivedURLQuerySet(ShardedQuerySet):
+    def expired(self, now=None):
+        """Archived links past their expiry time or click limit"""
+        now = now or timezone.now()
+        return self.filter(
+            Q(expires_at__lte=now) |
+            Q(max_clicks__isnull=False, clicks__gte=F('max_clicks'))
+        )
+
+
+class ArchivedURL(models.Model):
+    """Cold tier for links that have not been clicked in a long time"""
+    # See ShortenedURL.user
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, null=True, blank=True, related_name='archived_urls',
+                             db_constraint=False)
+    original_url = models.URLField(max_length=2048)
+    short_code = models.CharField(max_length=10, unique=True)
+    created_at = models.DateTimeField()
+    clicks = models.IntegerField(default=0)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    max_clicks = models.PositiveIntegerField(null=True, blank=True)
+    last_clicked_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    objects = ArchivedURLQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.short_code} -> {self.original_url} (archived)"
+
+    # Columns copied verbatim between the hot and cold tables
+    TIERED_FIELDS = (
+        'user_id', 'original_url', 'short_code', 'created_at',
+        'clicks', 'expires_at', 'max_clicks', 'last_clicked_at',
+    )
+
+    @classmethod
+    def from_shortened_url(cls, url_obj, now=None):
+        """Build an (unsaved) archive row for a hot link"""
+        fields = {name: getattr(url_obj, name) for name in cls.TIERED_FIELDS}
+        return cls(archived_at=now or timezone.now(), **fields)
+
+    def promote(self):
+        """
+        Move this link back into the hot table.
+
+        Returns:
+            The promoted ShortenedURL instance
+        """
+        using = self._state.db
+        fields = {name: getattr(self, name) for name in self.TIERED_FIELDS}
+        with transaction.atomic(using=using):
+            deleted, _ = ArchivedURL.objects.using(using).filter(pk=self.pk).delete()
+            if not deleted:
+                # Promoted concurrently by another request
+                return ShortenedURL.objects.using(using).get(short_code=self.short_code)
+            return ShortenedURL.restore(using, **fields)
+
+    def retire(self):
+        """Delete this link from the archive, holding its code in quarantine like ShortenedURL.retire"""
+        using = self._state.db
+        with transaction.atomic(using=using):
+            ExpiredURL.from_shortened_url(self).save(using=using)
+            VisitorSketch.objects.using(using).filter(short_code=self.short_code).delete()
+            self.delete()
+        revoke_codes([self.short_code])
+
+
+class ExpiredURLQuerySet(ShardedQuerySet):
+    def quarantined(self, now=None):
+        """Archived links whose short code may not be reused yet"""
+        return self.filter(expired_at__gt=self._quarantine_cutoff(now))
+
+    def released(self, now=None):
+        """Archived links whose short code is free to be recycled"""
+        return self.filter(expired_at__lte=self._quarantine_cutoff(now))
+
+    @staticmethod
+    def _quarantine_cutoff(now):
+        return (now or timezone.now()) - timedelta(days=settings.LINK_CODE_QUARANTINE_DAYS)
+
+
+class ExpiredURL(models.Model):
+    """Archive of links removed by the expiry reaper"""
+    # See ShortenedURL.user
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, null=True, blank=True, related_name='expired_urls',
+                             db_constraint=False)
+    original_url = models.URLField(max_length=2048)
+    short_code = models.CharField(max_length=10, db_index=True)
+    created_at = models.DateTimeField()
+    clicks = models.IntegerField(default=0)
+    expired_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    objects = ExpiredURLQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['-expired_at']
+
+    def __str__(self):
+        return f"{self.short_code} (expired {self.expired_at:%Y-%m-%d})"
+
+    @classmethod
+    def from_shortened_url(cls, url_obj, now=None):
+        """Build an (unsaved) archive row for an expired link"""
+        return cls(
+            user_id=url_obj.user_id,
+            original_url=url_obj.original_url,
+            short_code=url_obj.short_code,
+            created_at=url_obj.created_at,
+            clicks=url_obj.clicks,
+            expired_at=now or timezone.now(),
+        )
+
+
+class VisitorSketchQuerySet(ShardedQuerySet):
+    # Attempts at merging into a row that another writer is creating at the same time
+    MERGE_ATTEMPTS = 3
+
+    def merge(self, short_code, day, sketch):
+        """
+        Merge a HyperLogLog sketch into the stored one for a link and day.
+
+        Args:
+            short_code: The link's short code
+            day: Date the visits happened on, or VisitorSketch.ALL_TIME
+            sketch: HyperLogLog to fold in
+        """
+        using = shard_for(short_code)
+        for attempt in range(self.MERGE_ATTEMPTS):
+            try:
+                with transaction.atomic(using=using):
+                    row, created = self.using(using).select_for_update().get_or_create(
+                        short_code=short_code, day=day, defaults={'sketch': sketch.to_bytes()},
+                    )
+                    if not created:
+                        stored = HyperLogLog.from_bytes(row.sketch)
+                        stored.merge(sketch)
+                        row.sketch = stored.to_bytes()
+                        row.save(update_fields=['sketch', 'updated_at'])
+                return
+            except IntegrityError:
+                # Lost the race to create the row; the next attempt merges into it
+                if attempt == self.MERGE_ATTEMPTS - 1:
+                    raise
+
+    def stale(self, now=None):
+        """Daily sketches past the retention period; all-time sketches are kept"""
+        cutoff = timezone.localdate(now) - timedelta(days=settings.VISITOR_SKETCH_RETENTION_DAYS)
+        return self.filter(day__lt=cutoff).exclude(day=VisitorSketch.ALL_TIME)
+
+
+class VisitorSketch(models.Model):
+    """HyperLogLog sketch of a link's visitors for one day, or all time when day is ALL_TIME"""
+    # Not NULL, which unique_together would let repeat
+    ALL_TIME = date.min
+
+    # Keyed by code rather than a foreign key so counts survive tiering
+    short_code = models.CharField(max_length=10, db_index=True)
+    day = models.DateField()
+    sketch = models.BinaryField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = VisitorSketchQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('short_code', 'day')
+
+    def __str__(self):
+        return f"{self.short_code} ({'all time' if self.day == self.ALL_TIME else self.day})"
+
+
 class PasswordResetToken(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='password_reset_tokens')
     token = models.CharField(max_length=100, unique=True, db_index=True)
@@ -67,19 +433,88 @@ class PasswordResetToken(models.Model):
         return cls.objects.create(user=user, token=token, expires_at=expires_at)
 
 
+class APIToken(models.Model):
+    """Key for the JSON API; only a hash of the key is stored"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='api_tokens')
+    name = models.CharField(max_length=100, blank=True)
+    key_hash = models.CharField(max_length=64, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"API token for {self.user.username}{f' ({self.name})' if self.name else ''}"
+
+    @staticmethod
+    def hash_key(key):
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    @classmethod
+    def create_for_user(cls, user, name=''):
+        """
+        Create a new API token for a user.
+
+        Returns:
+            Tuple of (APIToken, key); the key cannot be recovered afterwards
+        """
+        key = secrets.token_urlsafe(32)
+        return cls.objects.create(user=user, name=name, key_hash=cls.hash_key(key)), key
+
+    @classmethod
+    def authenticate(cls, key):
+        """Return the active user an API key belongs to, or None"""
+        token = cls.objects.select_related('user').filter(key_hash=cls.hash_key(key)).first()
+        if token is None or not token.user.is_active:
+            return None
+        # Recording every use would turn each API read into a write
+        now = timezone.now()
+        if token.last_used_at is None or now - token.last_used_at > timedelta(minutes=5):
+            cls.objects.filter(pk=token.pk).update(last_used_at=now)
+        return token.user
+
+
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     photo = models.ImageField(upload_to='profile_photos/', null=True, blank=True)
+    photo_hash = models.CharField(max_length=64, blank=True)
+    photo_thumbnails_ready = models.BooleanField(default=False)
+    photo_processing_failed = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Profile of {self.user.username}"
 
-    def get_photo_url(self):
-        """Return photo URL or None"""
-        if self.photo:
-            return self.photo.url
+    @staticmethod
+    def thumbnail_name(photo_hash, size, fmt):
+        """Storage path of a generated thumbnail"""
+        extension = 'jpg' if fmt == 'jpeg' else fmt
+        return f"profile_photos/thumbs/{photo_hash[:2]}/{photo_hash}_{size}.{extension}"
+
+    def get_photo_url(self, size=None, fmt='jpeg'):
+        """
+        Return photo URL or None.
+
+        Serves a small thumbnail once the upload pipeline has produced one.
+        Until then (or if processing failed) there is no URL: the upload may
+        still carry EXIF data such as a GPS position, so callers fall back to
+        the identicon. Photos from before the pipeline are served as stored.
+        """
+        if not self.photo:
+            return None
+        if self.photo_hash:
+            if not self.photo_thumbnails_ready:
+                return None
+            size = size or settings.PROFILE_PHOTO_THUMBNAIL_SIZES[-1]
+            return default_storage.url(self.thumbnail_name(self.photo_hash, size, fmt))
+        return self.photo.url
+
+    def get_photo_webp_url(self):
+        """Return the WebP thumbnail URL, or None while it is being generated"""
+        if self.photo and self.photo_hash and self.photo_thumbnails_ready:
+            return self.get_photo_url(fmt='webp')
         return None
 
 
@@ -0,0 +1,168 @@
+# shortener/photo_utils.py
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+
+from .models import UserProfile
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+# Re-encoding settings for originals, by Pillow format
+ORIGINAL_OPTIONS = {
+    'JPEG': {'quality': 92},
+    'WEBP': {'quality': 92},
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def store_original(uploaded_file):
+    """
+    Store an uploaded photo under a path derived from its content.
+
+    Identical uploads map to the same file, so re-uploads and shared images
+    are stored (and thumbnailed) once. The file is stored as uploaded and
+    stripped of metadata by generate_thumbnails; it is not served until then.
+
+    Args:
+        uploaded_file: Django UploadedFile
+
+    Returns:
+        (sha256 hex digest, storage name) tuple
+    """
+    digest = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+    photo_hash = digest.hexdigest()
+
+    extension = os.path.splitext(uploaded_file.name)[1].lower() or '.img'
+    name = f"profile_photos/originals/{photo_hash[:2]}/{photo_hash}{extension}"
+    if not default_storage.exists(name):
+        uploaded_file.seek(0)
+        name = default_storage.save(name, uploaded_file)
+    return photo_hash, name
+
+
+def thumbnails_exist(photo_hash):
+    """Check whether every thumbnail for a photo has already been generated"""
+    return all(
+        default_storage.exists(UserProfile.thumbnail_name(photo_hash, size, fmt))
+        for size in settings.PROFILE_PHOTO_THUMBNAIL_SIZES
+        for fmt in THUMBNAIL_FORMATS
+    )
+
+
+def generate_thumbnails(photo_hash, original_name):
+    """
+    Generate square thumbnails of an original photo in every configured size.
+
+    EXIF orientation is applied before encoding. The original is re-encoded
+    in place, and neither it nor the thumbnails keep any metadata (EXIF, GPS
+    position, comments).
+    """
+    # Pillow is imported on first use to keep it out of worker startup
+    from PIL import Image, ImageOps
+
+    with default_storage.open(original_name, 'rb') as f:
+        img = Image.open(f)
+        source_format = img.format if img.format in Image.SAVE else 'PNG'
+        img = ImageOps.exif_transpose(img)
+
+    # Pillow only writes metadata that is passed to save() explicitly
+    buffer = BytesIO()
+    img.save(buffer, format=source_format, **ORIGINAL_OPTIONS.get(source_format, {}))
+    default_storage.delete(original_name)
+    default_storage.save(original_name, ContentFile(buffer.getvalue()))
+
+    img = img.convert('RGB')
+
+    # Largest first, so each resize starts from the smallest adequate source
+    for size in sorted(settings.PROFILE_PHOTO_THUMBNAIL_SIZES, reverse=True):
+        img = ImageOps.fit(img, (size, size), Image.Resampling.LANCZOS)
+        for fmt, options in THUMBNAIL_FORMATS.items():
+            buffer = BytesIO()
+            img.save(buffer, **options)
+            name = UserProfile.thumbnail_name(photo_hash, size, fmt)
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            default_storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def process_profile_photo(profile_id, photo_hash, original_name):
+    """
+    Build thumbnails and mark the profile as ready.
+
+    A failure is logged and recorded on the profile, so the user is told
+    and process_profile_photos can pick the photo up again.
+
+    Returns:
+        True if the thumbnails are in place
+    """
+    # Only the photo this was queued for; the user may have uploaded another
+    profiles = UserProfile.objects.filter(pk=profile_id, photo_hash=photo_hash)
+    try:
+        if not thumbnails_exist(photo_hash):
+            generate_thumbnails(photo_hash, original_name)
+    except Exception:
+        logger.exception('Processing profile photo %s failed', photo_hash)
+        profiles.update(photo_processing_failed=True)
+        return False
+    profiles.update(photo_thumbnails_ready=True, photo_processing_failed=False)
+    return True
+
+
+def _process_in_worker(*args):
+    """Worker task: process_profile_photo, releasing the thread's connection"""
+    try:
+        process_profile_photo(*args)
+    except Exception:
+        logger.exception('Processing profile photo %s failed', args[1])
+    finally:
+        connection.close()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.PROFILE_PHOTO_WORKERS,
+                thread_name_prefix='profile-photo',
+            )
+    return _executor
+
+
+def save_profile_photo(profile, uploaded_file):
+    """
+    Attach a newly uploaded photo to a profile and queue its thumbnails.
+
+    The upload is stored content-addressed and the profile saved right away;
+    resizing happens on the worker pool once the transaction commits, so the
+    request does not wait for it.
+    """
+    photo_hash, name = store_original(uploaded_file)
+    profile.photo = name
+    profile.photo_hash = photo_hash
+    profile.photo_thumbnails_ready = thumbnails_exist(photo_hash)
+    profile.photo_processing_failed = False
+    profile.save()
+
+    if not profile.photo_thumbnails_ready:
+        args = (profile.pk, photo_hash, name)
+        if settings.PROFILE_PHOTO_WORKERS:
+            transaction.on_commit(lambda: get_executor().submit(_process_in_worker, *args))
+        else:
+            process_profile_photo(*args)
@@ -0,0 +1,283 @@
+# shortener/prefork.py
+"""
+Pre-forking WSGI server for redirect traffic.
+
+The master process binds the listening socket, maps the redirect snapshot
+once and forks N workers that inherit both, so the snapshot pages are shared
+through the OS page cache instead of being loaded per process. Workers push
+their buffered click counts, visitor sketches and trending summaries over a
+queue to a single flusher process, which merges them and is the only process
+that writes them out. Failed writes are retried on the next round, and the
+master restarts the flusher as well as workers if they die.
+
+Signals handled by the master:
+    SIGHUP   replace workers one by one (graceful reload)
+    SIGUSR1  print per-worker stats
+    SIGTERM  let workers finish their current request, flush clicks and exit
+"""
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+from collections import Counter
+from queue import Empty
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+
+from django import db
+from django.core.handlers.wsgi import WSGIHandler
+
+from . import clicks, sessions, trending, visitors
+from .snapshot import get_snapshot
+
+logger = logging.getLogger(__name__)
+
+STAT_FIELDS = ('requests', 'redirects', 'not_found', 'errors', 'total_ms')
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class StatsMiddleware:
+    """Count requests by outcome into this worker's slot of a shared array"""
+
+    def __init__(self, app, stats, slot):
+        self.app = app
+        self.stats = stats
+        self.base = slot * len(STAT_FIELDS)
+
+    def __call__(self, environ, start_response):
+        started = time.perf_counter()
+        statuses = []
+
+        def counting_start_response(status, headers, exc_info=None):
+            statuses.append(int(status[:3]))
+            return start_response(status, headers, exc_info)
+
+        try:
+            return self.app(environ, counting_start_response)
+        finally:
+            status = statuses[-1] if statuses else 500
+            with self.stats.get_lock():
+                self.stats[self.base] += 1
+                self.stats[self.base + 1] += 300 <= status < 400
+                self.stats[self.base + 2] += status == 404
+                self.stats[self.base + 3] += status >= 500
+                self.stats[self.base + 4] += (time.perf_counter() - started) * 1000
+
+
+class WorkerServer(WSGIServer):
+    """WSGIServer running on an already bound, shared listening socket"""
+
+    def __init__(self, listener):
+        super().__init__(listener.getsockname(), QuietRequestHandler, bind_and_activate=False)
+        self.socket.close()
+        self.socket = listener
+        host, port = listener.getsockname()[:2]
+        self.server_name = socket.getfqdn(host)
+        self.server_port = port
+        self.setup_environ()
+
+    def service_actions(self):
+        # Called between requests; keeps idle workers from sitting on writes
+        clicks.click_buffer.flush_if_due()
+        visitors.visitor_buffer.flush_if_due()
+        trending.trending_buffer.flush_if_due()
+        sessions.flush_pending_if_due()
+
+
+def run_worker(listener, slot, stats, click_queue, flush_interval):
+    """Entry point of a forked worker process"""
+    # Connections inherited from the master must not be shared
+    db.connections.close_all()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+
+    clicks.click_buffer.sink = lambda counts: click_queue.put(('clicks', dict(counts)))
+    clicks.click_buffer.flush_interval = flush_interval
+    visitors.visitor_buffer.sink = lambda sketches: click_queue.put(('visitors', sketches))
+    visitors.visitor_buffer.flush_interval = flush_interval
+    trending.trending_buffer.sink = lambda buckets: click_queue.put(('trending', buckets))
+    trending.trending_buffer.flush_interval = flush_interval
+
+    server = WorkerServer(listener)
+    server.set_app(StatsMiddleware(WSGIHandler(), stats, slot))
+    # shutdown() blocks until serve_forever() returns, so it needs its own thread
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    server.serve_forever(poll_interval=0.5)
+    clicks.click_buffer.flush()
+    visitors.visitor_buffer.flush()
+    trending.trending_buffer.flush()
+    sessions.flush_pending()
+    click_queue.close()
+    click_queue.join_thread()
+
+
+def run_flusher(click_queue, flush_interval):
+    """Entry point of the process that aggregates and writes out worker counters"""
+    db.connections.close_all()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+
+    pending = Counter()
+    pending_sketches = {}
+    pending_trending = {}
+
+    def write_pending():
+        # Click counts and trending buckets are dropped from the mappings as
+        # they are written, and merging a sketch twice is harmless, so after
+        # an error (e.g. "database is locked") the rest is retried next round
+        try:
+            if pending:
+                clicks.write_clicks(pending)
+            if pending_sketches:
+                visitors.write_sketches(pending_sketches)
+                pending_sketches.clear()
+            if pending_trending:
+                trending.publish_buckets(pending_trending)
+        except Exception:
+            logger.exception('Writing buffered counters failed; will retry')
+
+    last_flush = time.monotonic()
+    while True:
+        try:
+            item = click_queue.get(timeout=flush_interval)
+        except Empty:
+            item = None, {}
+        if item is None:
+            break
+        kind, payload = item
+        if kind == 'clicks':
+            pending.update(payload)
+        elif kind == 'visitors':
+            visitors.merge_sketches(pending_sketches, payload)
+        elif kind == 'trending':
+            trending.merge_buckets(pending_trending, payload)
+        if time.monotonic() - last_flush >= flush_interval:
+            write_pending()
+            last_flush = time.monotonic()
+    write_pending()
+
+
+class PreforkServer:
+    def __init__(self, host, port, workers, flush_interval=1.0, stats_interval=0, log=print):
+        self.address = (host, port)
+        self.worker_count = workers
+        self.flush_interval = flush_interval
+        self.stats_interval = stats_interval
+        self.log = log
+        self.workers = {}
+        self._reload = self._stop = self._report = False
+
+    def spawn(self, slot):
+        process = self.context.Process(
+            target=run_worker,
+            args=(self.listener, slot, self.stats, self.click_queue, self.flush_interval),
+            name=f'redirect-worker-{slot}',
+        )
+        process.start()
+        return process
+
+    def spawn_flusher(self):
+        process = self.context.Process(target=run_flusher, args=(self.click_queue, self.flush_interval),
+                                       name='click-flusher')
+        process.start()
+        return process
+
+    def run(self):
+        self.context = multiprocessing.get_context('fork')
+        self.listener = socket.create_server(self.address, backlog=1024)
+        self.stats = self.context.Array('d', self.worker_count * len(STAT_FIELDS))
+        self.click_queue = self.context.Queue()
+
+        # Map the snapshot before forking so every worker shares its pages
+        get_snapshot()
+        db.connections.close_all()
+
+        self.flusher = self.spawn_flusher()
+        self.workers = {slot: self.spawn(slot) for slot in range(self.worker_count)}
+        self.log(f'Serving on http://{self.address[0]}:{self.address[1]}/ with '
+                 f'{self.worker_count} worker(s) (master pid {os.getpid()})')
+
+        signal.signal(signal.SIGHUP, lambda *args: setattr(self, '_reload', True))
+        signal.signal(signal.SIGUSR1, lambda *args: setattr(self, '_report', True))
+        signal.signal(signal.SIGTERM, lambda *args: setattr(self, '_stop', True))
+        signal.signal(signal.SIGINT, lambda *args: setattr(self, '_stop', True))
+
+        last_report = time.monotonic()
+        try:
+            while not self._stop:
+                time.sleep(0.2)
+                if self._reload:
+                    self._reload = False
+                    self.reload()
+                if self._report or (self.stats_interval and time.monotonic() - last_report >= self.stats_interval):
+                    self._report = False
+                    last_report = time.monotonic()
+                    self.report()
+                for slot, process in list(self.workers.items()):
+                    if not process.is_alive() and not self._stop:
+                        self.log(f'Worker {slot} (pid {process.pid}) exited with {process.exitcode}, restarting')
+                        self.workers[slot] = self.spawn(slot)
+                if not self.flusher.is_alive() and not self._stop:
+                    self.log(f'Flusher (pid {self.flusher.pid}) exited with {self.flusher.exitcode}, restarting')
+                    self.restart_flusher()
+        finally:
+            self.shutdown()
+
+    def restart_flusher(self):
+        """Start a new flusher, moving workers over to a fresh queue"""
+        # Workers keep queueing counters, which would pile up without a reader.
+        # A flusher that died waiting on the queue still holds its read lock,
+        # so the old queue cannot be read from again.
+        self.click_queue = self.context.Queue()
+        self.flusher = self.spawn_flusher()
+        self.reload()
+
+    def reload(self):
+        """Replace workers one at a time so capacity never drops to zero"""
+        self.log('Reloading workers')
+        for slot, old in list(self.workers.items()):
+            self.workers[slot] = self.spawn(slot)
+            old.terminate()
+            # A worker still writing to an abandoned queue may never finish
+            old.join(timeout=10)
+            if old.is_alive():
+                old.kill()
+                old.join()
+
+    def shutdown(self):
+        for process in self.workers.values():
+            process.terminate()
+        for process in self.workers.values():
+            process.join()
+        self.click_queue.put(None)
+        self.flusher.join()
+        self.listener.close()
+        self.report()
+
+    def worker_stats(self):
+        """Return a list of per-worker stat dicts"""
+        size = len(STAT_FIELDS)
+        with self.stats.get_lock():
+            values = list(self.stats)
+        rows = []
+        for slot, process in sorted(self.workers.items()):
+            row = dict(zip(STAT_FIELDS, values[slot * size:(slot + 1) * size]))
+            row.update(slot=slot, pid=process.pid)
+            rows.append(row)
+        return rows
+
+    def report(self):
+        for row in self.worker_stats():
+            average = row['total_ms'] / row['requests'] if row['requests'] else 0
+            self.log(f"worker {row['slot']} pid {row['pid']}: {int(row['requests'])} requests, "
+                     f"{int(row['redirects'])} redirects, {int(row['not_found'])} not found, "
+                     f"{int(row['errors'])} errors, {average:.2f} ms avg")
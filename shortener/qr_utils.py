@@ -0,0 +1,95 @@
+# shortener/qr_utils.py
+import hashlib
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import caches
+
+ERROR_CORRECTION_LEVELS = ('L', 'M', 'Q', 'H')
+CONTENT_TYPES = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+
+def generate_qr_code(data, fmt='png', box_size=10, error_correction='M', border=4):
+    """
+    Render a QR code for the given data.
+
+    Args:
+        data: Text to encode (the short URL)
+        fmt: 'png' or 'svg'
+        box_size: Size of each module in pixels
+        error_correction: One of 'L', 'M', 'Q', 'H'
+        border: Quiet zone width in modules
+
+    Returns:
+        Encoded image as bytes
+    """
+    # qrcode (and Pillow, for PNG) are imported on first use to keep them
+    # out of worker startup
+    import qrcode
+    import qrcode.image.svg
+
+    qr = qrcode.QRCode(
+        error_correction=getattr(qrcode.constants, f'ERROR_CORRECT_{error_correction}'),
+        box_size=box_size,
+        border=border,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+
+    image_factory = qrcode.image.svg.SvgPathImage if fmt == 'svg' else None
+    img = qr.make_image(image_factory=image_factory)
+    buffer = BytesIO()
+    img.save(buffer)
+    return buffer.getvalue()
+
+
+def qr_code_key(data, fmt, box_size, error_correction):
+    """
+    Content hash identifying one rendering of a QR code.
+
+    The same inputs always produce the same image, so this doubles as the
+    cache key and the ETag.
+    """
+    source = f'{fmt}:{box_size}:{error_correction}:{data}'
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+def get_qr_code(data, fmt='png', box_size=10, error_correction='M'):
+    """
+    Return a QR code from the cache, rendering and storing it on a miss.
+
+    Returns:
+        Encoded image as bytes
+    """
+    cache = caches[settings.QR_CODE_CACHE_ALIAS]
+    key = qr_code_key(data, fmt, box_size, error_correction)
+    content = cache.get(key)
+    if content is None:
+        content = generate_qr_code(data, fmt, box_size, error_correction)
+        cache.set(key, content, timeout=None)
+    return content
+
+
+def pregenerate_qr_codes(short_urls, formats=('png',), box_size=10, error_correction='M'):
+    """
+    Warm the QR cache for a batch of short URLs, e.g. after a bulk import.
+
+    Args:
+        short_urls: Iterable of absolute short URLs
+        formats: Image formats to render for each URL
+
+    Returns:
+        Number of images rendered (cache hits are skipped)
+    """
+    cache = caches[settings.QR_CODE_CACHE_ALIAS]
+    rendered = 0
+    for short_url in short_urls:
+        for fmt in formats:
+            key = qr_code_key(short_url, fmt, box_size, error_correction)
+            if not cache.has_key(key):
+                cache.set(key, generate_qr_code(short_url, fmt, box_size, error_correction), timeout=None)
+                rendered += 1
+    return rendered
@@ -0,0 +1,193 @@
+# shortener/search.py
+"""
+Search over shortened links.
+
+SQLite databases keep an FTS5 index of each link's short code and URL
+tokens (host labels, path segments, query words), maintained from model
+signals. Tables without an index (the link archive) are matched by the same
+rule with regular filters. PostgreSQL relies on pg_trgm GIN indexes over short_code and
+original_url, which serve ILIKE substring matches without a separate table.
+Other backends fall back to plain ``icontains`` filters.
+"""
+import re
+from urllib.parse import urlsplit
+
+from django.db import connections, router
+from django.db.models import BooleanField, Q
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'shortener_shortenedurl_fts'
+TRIGRAM_INDEXES = {
+    'shortener_shortenedurl_code_trgm': 'short_code',
+    'shortener_shortenedurl_url_trgm': 'original_url',
+}
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def url_tokens(url):
+    """
+    Split a URL into lowercase search tokens.
+
+    Args:
+        url: URL to tokenize
+
+    Returns:
+        Space separated tokens from the host, path and query string
+    """
+    parts = urlsplit(url.lower())
+    return ' '.join(TOKEN_RE.findall(f'{parts.hostname or ""} {parts.path} {parts.query}'))
+
+
+class FallbackBackend:
+    def install(self, connection):
+        pass
+
+    def index(self, url_obj, using):
+        pass
+
+    def remove(self, pk, using):
+        pass
+
+    def rebuild(self, queryset, using, batch_size):
+        return 0
+
+    def search(self, queryset, query):
+        for term in query.split():
+            queryset = queryset.filter(Q(short_code__icontains=term) | Q(original_url__icontains=term))
+        return queryset
+
+    def search_unindexed(self, queryset, query):
+        return self.search(queryset, query)
+
+
+class SQLiteFTSBackend(FallbackBackend):
+    def install(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} '
+                f'USING fts5(short_code, tokens, tokenize="unicode61")'
+            )
+
+    def index(self, url_obj, using):
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                f'INSERT OR REPLACE INTO {FTS_TABLE} (rowid, short_code, tokens) VALUES (%s, %s, %s)',
+                [url_obj.pk, url_obj.short_code.lower(), url_tokens(url_obj.original_url)]
+            )
+
+    def remove(self, pk, using):
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [pk])
+
+    def rebuild(self, queryset, using, batch_size):
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            rows = queryset.using(using).values_list('pk', 'short_code', 'original_url')
+            batch = []
+            indexed = 0
+            for pk, short_code, original_url in rows.iterator(chunk_size=batch_size):
+                batch.append((pk, short_code.lower(), url_tokens(original_url)))
+                if len(batch) >= batch_size:
+                    indexed += self._insert(cursor, batch)
+                    batch = []
+            return indexed + self._insert(cursor, batch)
+
+    def _insert(self, cursor, rows):
+        if rows:
+            cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, short_code, tokens) VALUES (%s, %s, %s)', rows)
+        return len(rows)
+
+    def search(self, queryset, query):
+        terms = TOKEN_RE.findall(query.lower())
+        if not terms:
+            return queryset
+        # Every term must match, each as a prefix
+        match = ' AND '.join(f'"{term}"*' for term in terms)
+        return queryset.filter(pk__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match]))
+
+    def search_unindexed(self, queryset, query):
+        # Each term must start a token, as in search(). The URL pattern needs
+        # a separator before the term, which leaves out the scheme just like
+        # url_tokens() does
+        for term in TOKEN_RE.findall(query.lower()):
+            queryset = queryset.filter(
+                Q(short_code__iregex=rf'(^|[^a-z0-9]){term}') | Q(original_url__iregex=rf'[^a-z0-9]{term}')
+            )
+        return queryset
+
+
+def escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class PostgresTrigramBackend(FallbackBackend):
+    def install(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            for index, column in TRIGRAM_INDEXES.items():
+                cursor.execute(
+                    f'CREATE INDEX IF NOT EXISTS {index} ON shortener_shortenedurl '
+                    f'USING gin ({column} gin_trgm_ops)'
+                )
+
+    def search(self, queryset, query):
+        # icontains compiles to UPPER(col::text) LIKE UPPER(...), which the
+        # trigram indexes cannot serve; plain ILIKE on the columns can
+        table = queryset.model._meta.db_table
+        for term in query.split():
+            pattern = f'%{escape_like(term)}%'
+            queryset = queryset.filter(RawSQL(
+                f'("{table}"."short_code" ILIKE %s OR "{table}"."original_url" ILIKE %s)',
+                [pattern, pattern],
+                output_field=BooleanField(),
+            ))
+        return queryset
+
+
+BACKENDS = {
+    'sqlite': SQLiteFTSBackend(),
+    'postgresql': PostgresTrigramBackend(),
+}
+
+
+def get_backend(using='default'):
+    return BACKENDS.get(connections[using].vendor, FallbackBackend())
+
+
+def search_links(queryset, query):
+    """
+    Filter a queryset of links down to those matching a search query.
+
+    Args:
+        queryset: ShortenedURL or ArchivedURL queryset, e.g. already scoped
+            to one user
+        query: Free text search entered by the user
+
+    Returns:
+        Filtered queryset
+    """
+    from .models import ShortenedURL
+
+    backend = get_backend(queryset.db)
+    if queryset.model is ShortenedURL:
+        return backend.search(queryset, query)
+    return backend.search_unindexed(queryset, query)
+
+
+def install_search_index(sender, using='default', **kwargs):
+    """post_migrate handler creating the search index for the database"""
+    from .models import ShortenedURL
+
+    # Only databases that hold links (see shortener.sharding) need an index
+    if router.allow_migrate_model(using, ShortenedURL):
+        get_backend(using).install(connections[using])
+
+
+def index_shortened_url(sender, instance, using, **kwargs):
+    """post_save handler keeping the search index in sync"""
+    get_backend(using).index(instance, using)
+
+
+def unindex_shortened_url(sender, instance, using, **kwargs):
+    """post_delete handler keeping the search index in sync"""
+    get_backend(using).remove(instance.pk, using)
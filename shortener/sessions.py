@@ -0,0 +1,202 @@
+# shortener/sessions.py
+"""
+Write-behind cached session store.
+
+Sessions are read from the cache and only fall back to the database on a
+miss. Saves are skipped entirely when the session data has not actually
+changed; real changes go to the cache at once and are queued for the
+database, which receives them in batched upserts within
+SESSION_WRITE_BEHIND_INTERVAL seconds, whether or not more requests arrive.
+New sessions, and changes made in the request that created them (logging in
+cycles the session key), are still written through, so session keys stay
+unique and a login never depends on the cache alone.
+
+Deleting a session leaves a marker in the cache, so changes to it still
+queued in other processes are dropped instead of bringing it back.
+
+The cache must be shared by every process serving requests (see the
+'sessions' alias in settings), otherwise a worker could read a session the
+database has not caught up with yet.
+"""
+import atexit
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+from django.core.cache import caches
+from django.db import connections, router
+from django.utils import timezone
+
+# Longer than a change can stay queued in any process
+DELETED_MARKER_TIMEOUT = 60 * 60
+
+# session key -> (database name, Session instance)
+_pending = {}
+_pending_lock = threading.Lock()
+_last_flush = time.monotonic()
+_timer = None
+
+
+def deleted_key(session_key):
+    return f'shortener.sessions.deleted.{session_key}'
+
+
+def _database_name():
+    model = SessionStore.get_model_class()
+    return connections[router.db_for_write(model)].settings_dict['NAME']
+
+
+class SessionStore(CachedDBStore):
+    cache_key_prefix = 'shortener.sessions'
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self._loaded_fingerprint = None
+        self._write_through = False
+
+    def _fingerprint(self, data):
+        return hashlib.sha1(self.serializer().dumps(data)).hexdigest()
+
+    def load(self):
+        data = None
+        try:
+            data = self._cache.get(self.cache_key)
+        except Exception:
+            # Invalid cache keys on some backends; treat as a miss
+            pass
+        if data is None:
+            with _pending_lock:
+                pending = _pending.get(self.session_key)
+            if pending is not None and self._cache.get(deleted_key(self.session_key)) is None:
+                data = self.decode(pending[1].session_data)
+            else:
+                s = self._get_session_from_db()
+                if s:
+                    data = self.decode(s.session_data)
+                    self._cache.set(self.cache_key, data, self.get_expiry_age(expiry=s.expire_date))
+                else:
+                    data = {}
+        self._loaded_fingerprint = self._fingerprint(data)
+        return data
+
+    def save(self, must_create=False):
+        if must_create or self.session_key is None:
+            super().save(must_create)
+            self._loaded_fingerprint = self._fingerprint(self._session)
+            self._write_through = True
+            return
+
+        data = self._get_session()
+        fingerprint = self._fingerprint(data)
+        if fingerprint == self._loaded_fingerprint:
+            return
+
+        if self._write_through:
+            super().save()
+        else:
+            self._cache.set(self.cache_key, data, self.get_expiry_age())
+            with _pending_lock:
+                _pending[self.session_key] = (_database_name(), self.create_model_instance(data))
+            schedule_flush()
+        self._loaded_fingerprint = fingerprint
+
+    def delete(self, session_key=None):
+        session_key = session_key or self.session_key
+        if session_key is not None:
+            with _pending_lock:
+                _pending.pop(session_key, None)
+            self._cache.set(deleted_key(session_key), True, DELETED_MARKER_TIMEOUT)
+        super().delete(session_key)
+
+    @classmethod
+    def clear_expired(cls, batch_size=1000):
+        """Delete expired sessions in batches to keep each transaction short"""
+        model = cls.get_model_class()
+        deleted = 0
+        while True:
+            keys = list(model.objects.filter(expire_date__lt=timezone.now())
+                        .values_list('session_key', flat=True)[:batch_size])
+            if not keys:
+                return deleted
+            deleted += model.objects.filter(session_key__in=keys).delete()[0]
+
+
+def flush_pending():
+    """Write all queued session changes to the database in one upsert"""
+    global _last_flush
+
+    with _pending_lock:
+        pending = dict(_pending)
+        _pending.clear()
+        _last_flush = time.monotonic()
+    if not pending:
+        return
+
+    # Changes queued against another database are dropped; the test runner
+    # swaps the real database back in before atexit handlers run
+    database = _database_name()
+    cache = caches[settings.SESSION_CACHE_ALIAS]
+    deleted = cache.get_many([deleted_key(key) for key in pending])
+    sessions = {
+        key: session for key, (name, session) in pending.items()
+        if name == database and deleted_key(key) not in deleted
+    }
+    if not sessions:
+        return
+
+    model = SessionStore.get_model_class()
+    objects = model.objects.using(router.db_for_write(model))
+    try:
+        objects.bulk_create(
+            sessions.values(),
+            update_conflicts=True,
+            unique_fields=['session_key'],
+            update_fields=['session_data', 'expire_date'],
+        )
+    except Exception:
+        # Requeue, unless a newer change has been queued in the meantime
+        with _pending_lock:
+            for key in sessions:
+                _pending.setdefault(key, pending[key])
+        raise
+    # A session deleted by another process while the upsert ran stays deleted
+    deleted = cache.get_many([deleted_key(key) for key in sessions])
+    if deleted:
+        objects.filter(session_key__in=[key for key in sessions if deleted_key(key) in deleted]).delete()
+
+
+def flush_pending_if_due():
+    if time.monotonic() - _last_flush >= settings.SESSION_WRITE_BEHIND_INTERVAL:
+        flush_pending()
+
+
+def schedule_flush():
+    """Make sure queued changes are written even if this process goes idle"""
+    global _timer
+
+    with _pending_lock:
+        if _timer is not None and _timer.is_alive():
+            return
+        _timer = threading.Timer(settings.SESSION_WRITE_BEHIND_INTERVAL, _flush_from_timer)
+        _timer.daemon = True
+        _timer.start()
+
+
+def _flush_from_timer():
+    global _timer
+
+    with _pending_lock:
+        _timer = None
+    try:
+        flush_pending()
+    finally:
+        # The timer thread has its own database connections
+        connections.close_all()
+        if _pending:
+            # Left over from a failed write, or queued while this one ran
+            schedule_flush()
+
+
+atexit.register(flush_pending)
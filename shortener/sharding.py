@@ -0,0 +1,149 @@
+# shortener/sharding.py
+"""
+Horizontal sharding of links by short code.
+
+SHORTENER_SHARDS lists the database aliases that hold ShortenedURL and its
+per-link tables. Each short code is placed on one of them by a consistent
+hash ring, so adding a shard only moves roughly 1/N of the codes (see
+`manage.py rebalance_shards`). Everything else (users, sessions, profiles)
+stays on the default database. With SHORTENER_SHARDS empty the router stays
+out of the way and all models live on 'default'.
+
+Lookups by code go to exactly one shard via ``for_code()``; per-user and
+global queries fan out with ``on_shards()``.
+"""
+import bisect
+import hashlib
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, models
+
+SHARDED_MODELS = {
+    'shortener.shortenedurl',
+    'shortener.archivedurl',
+    'shortener.expiredurl',
+    'shortener.linkhealth',
+    'shortener.visitorsketch',
+}
+VIRTUAL_NODES = 128
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes"""
+
+    def __init__(self, aliases, virtual_nodes=VIRTUAL_NODES):
+        points = sorted(
+            (_hash(f'{alias}#{replica}'), alias)
+            for alias in aliases
+            for replica in range(virtual_nodes)
+        )
+        self._keys = [point for point, _ in points]
+        self._aliases = [alias for _, alias in points]
+
+    def get(self, key):
+        index = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._aliases[index]
+
+
+@lru_cache(maxsize=None)
+def _ring(aliases):
+    return HashRing(aliases)
+
+
+def sharding_enabled():
+    return bool(settings.SHORTENER_SHARDS)
+
+
+def shard_aliases():
+    """Database aliases holding link data"""
+    return list(settings.SHORTENER_SHARDS) or [DEFAULT_DB_ALIAS]
+
+
+def shard_for(short_code):
+    """Database alias a short code belongs on"""
+    if not sharding_enabled():
+        return DEFAULT_DB_ALIAS
+    return _ring(tuple(settings.SHORTENER_SHARDS)).get(short_code)
+
+
+class ShardedQuerySet(models.QuerySet):
+    def for_code(self, short_code):
+        """Rows for one short code, read from the shard that owns it"""
+        return self.using(shard_for(short_code)).filter(short_code=short_code)
+
+    def on_shards(self):
+        """One copy of this queryset per shard, for fan-out queries"""
+        return [self.using(alias) for alias in shard_aliases()]
+
+    def create(self, **kwargs):
+        # The router never sees the instance here, so place the row by its code
+        short_code = kwargs.get('short_code')
+        if self._db is None and short_code:
+            return super(ShardedQuerySet, self.using(shard_for(short_code))).create(**kwargs)
+        return super().create(**kwargs)
+
+
+class ShardRouter:
+    """Route link models by short code and keep everything else on 'default'"""
+
+    def _db_for(self, model, **hints):
+        if not sharding_enabled():
+            return None
+        if model._meta.label_lower not in SHARDED_MODELS:
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None:
+            # Loaded rows stay where they are; new ones go where their code hashes
+            if instance._state.db:
+                return instance._state.db
+            short_code = getattr(instance, 'short_code', None)
+            if short_code:
+                return shard_for(short_code)
+        return None
+
+    db_for_read = _db_for
+    db_for_write = _db_for
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if not sharding_enabled():
+            return None
+        # Links on any shard may point at users on the default database
+        labels = {obj1._meta.label_lower, obj2._meta.label_lower}
+        if labels & SHARDED_MODELS:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if not sharding_enabled() or model_name is None:
+            return None
+        if f'{app_label}.{model_name}' in SHARDED_MODELS:
+            return db in shard_aliases()
+        return db == DEFAULT_DB_ALIAS
+
+
+def delete_user_links(sender, instance, using, **kwargs):
+    """
+    pre_delete handler for User.
+
+    Django only cascades within one database, so the link models opt out of
+    the ORM cascade and a user's links are removed along with their visitor
+    sketches (or detached, for the expiry archive) on every shard here.
+    """
+    from .models import ArchivedURL, ExpiredURL, ShortenedURL, VisitorSketch
+    from .snapshot import revoke_codes
+
+    for alias in shard_aliases():
+        codes = [
+            *ShortenedURL.objects.using(alias).filter(user_id=instance.pk).values_list('short_code', flat=True),
+            *ArchivedURL.objects.using(alias).filter(user_id=instance.pk).values_list('short_code', flat=True),
+        ]
+        VisitorSketch.objects.using(alias).filter(short_code__in=codes).delete()
+        ShortenedURL.objects.using(alias).filter(user_id=instance.pk).delete()
+        ArchivedURL.objects.using(alias).filter(user_id=instance.pk).delete()
+        ExpiredURL.objects.using(alias).filter(user_id=instance.pk).update(user=None)
+        revoke_codes(codes)
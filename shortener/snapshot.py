@@ -0,0 +1,190 @@
+# shortener/snapshot.py
+"""
+Static redirect snapshots.
+
+A snapshot is a read-only file holding ``short_code -> original_url``
+mappings sorted by code, so lookups are a binary search over a memory-mapped
+file with no database access. Layout (little endian)::
+
+    header   magic b'RSNP', version u16, entry count u32
+    offsets  one u32 file offset per entry, in code order
+    records  code length u8, expiry unix time i64 (0 = never),
+             URL length u16, code bytes, URL bytes
+
+Links saved or deleted after a snapshot was built (edited, archived, reaped
+or retired) are revoked in a shared cache by the signal handlers below, so
+their codes fall through to the database until the next build instead of
+redirecting from stale data.
+"""
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import caches
+
+MAGIC = b'RSNP'
+VERSION = 1
+HEADER = struct.Struct('<4sHI')
+OFFSET = struct.Struct('<I')
+RECORD = struct.Struct('<BqH')
+
+
+def write_snapshot(path, entries):
+    """
+    Write a snapshot file and atomically swap it into place.
+
+    Args:
+        path: Destination file path
+        entries: Iterable of (short_code, original_url, expires_at) tuples;
+            expires_at may be None
+
+    Returns:
+        Number of entries written
+    """
+    records = sorted(
+        (code.encode(), url.encode(), int(expires_at.timestamp()) if expires_at else 0)
+        for code, url, expires_at in entries
+    )
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.snapshot-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(records)))
+            position = HEADER.size + OFFSET.size * len(records)
+            for code, url, _ in records:
+                f.write(OFFSET.pack(position))
+                position += RECORD.size + len(code) + len(url)
+            for code, url, expires in records:
+                f.write(RECORD.pack(len(code), expires, len(url)))
+                f.write(code)
+                f.write(url)
+            f.flush()
+            os.fsync(f.fileno())
+        # Readers either see the old file or the complete new one
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return len(records)
+
+
+class RedirectSnapshot:
+    """Read-only view over a snapshot file"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.identity = (stat.st_ino, stat.st_mtime_ns)
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a version {VERSION} redirect snapshot')
+
+    def __len__(self):
+        return self.count
+
+    def _record(self, index):
+        offset, = OFFSET.unpack_from(self._map, HEADER.size + OFFSET.size * index)
+        code_len, expires, url_len = RECORD.unpack_from(self._map, offset)
+        start = offset + RECORD.size
+        return self._map[start:start + code_len], expires, start + code_len, url_len
+
+    def lookup(self, short_code):
+        """
+        Find the destination for a short code.
+
+        Args:
+            short_code: The short code to look up
+
+        Returns:
+            (original_url, expires_at) tuple, or None if the code is not present
+        """
+        key = short_code.encode()
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            code, expires, url_start, url_len = self._record(middle)
+            if code < key:
+                low = middle + 1
+            elif code > key:
+                high = middle
+            else:
+                url = self._map[url_start:url_start + url_len].decode()
+                expires_at = datetime.fromtimestamp(expires, dt_timezone.utc) if expires else None
+                return url, expires_at
+        return None
+
+
+_lock = threading.Lock()
+_current = None
+_last_check = 0.0
+
+
+def get_snapshot():
+    """
+    Return the active snapshot, reloading it when the file has been replaced.
+
+    The file is only stat()ed once per REDIRECT_SNAPSHOT_CHECK_INTERVAL
+    seconds. Returns None when snapshot serving is disabled or no snapshot
+    has been built yet.
+    """
+    global _current, _last_check
+
+    path = settings.REDIRECT_SNAPSHOT_PATH
+    if not path:
+        return None
+    now = time.monotonic()
+    if now - _last_check < settings.REDIRECT_SNAPSHOT_CHECK_INTERVAL:
+        return _current
+
+    with _lock:
+        _last_check = now
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            _current = None
+            return None
+        if _current is None or _current.identity != (stat.st_ino, stat.st_mtime_ns):
+            # The old map is released once in-flight lookups drop their reference
+            _current = RedirectSnapshot(path)
+    return _current
+
+
+def revoked_key(short_code):
+    return f'snapshot:revoked:{short_code}'
+
+
+def revoke_codes(short_codes):
+    """
+    Stop serving short codes from the snapshot until it is rebuilt.
+
+    Args:
+        short_codes: Codes of links that have just been changed or deleted
+    """
+    if not settings.REDIRECT_SNAPSHOT_PATH or not short_codes:
+        return
+    caches[settings.REDIRECT_SNAPSHOT_CACHE_ALIAS].set_many(
+        {revoked_key(code): True for code in short_codes},
+        settings.REDIRECT_SNAPSHOT_REVOCATION_TTL,
+    )
+
+
+def is_revoked(short_code):
+    """Check whether a code found in the snapshot has been changed or deleted since"""
+    return caches[settings.REDIRECT_SNAPSHOT_CACHE_ALIAS].get(revoked_key(short_code)) is not None
+
+
+def revoke_saved_link(sender, instance, **kwargs):
+    """post_save handler; the snapshot may hold the link's old destination"""
+    revoke_codes([instance.short_code])
+
+
+def revoke_deleted_link(sender, instance, **kwargs):
+    """post_delete handler; the snapshot may still hold the link"""
+    revoke_codes([instance.short_code])
@@ -0,0 +1,81 @@
+# shortener/spacesaving.py
+"""
+Space-Saving heavy hitters summary.
+
+Tracks at most ``capacity`` keys. When a new key arrives and the table is
+full, it takes over the slot of the key with the smallest count and inherits
+that count as its error. Counts are therefore overestimates by at most their
+error, and any key seen more than N / capacity times out of N is guaranteed
+to be tracked. Summaries merge by adding counts and errors, keeping the
+largest ``capacity`` keys.
+"""
+import heapq
+
+
+class SpaceSaving:
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        # (count, key) entries; stale ones are skipped when popping
+        self._heap = []
+
+    def add(self, key, count=1, error=0):
+        """
+        Count occurrences of a key.
+
+        Args:
+            key: Item to count
+            count: Number of occurrences
+            error: Extra error bound carried over from a merged summary
+        """
+        if key in self.counts:
+            self.counts[key] += count
+            self.errors[key] += error
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = count
+            self.errors[key] = error
+        else:
+            evicted, floor = self._pop_min()
+            del self.counts[evicted], self.errors[evicted]
+            self.counts[key] = floor + count
+            self.errors[key] = floor + error
+        self._push(key)
+
+    def merge(self, other):
+        """Fold another summary into this one"""
+        for key, count in other.counts.items():
+            self.add(key, count, other.errors[key])
+
+    def top(self, n=10):
+        """
+        Most frequent keys.
+
+        Returns:
+            List of (key, count, error) tuples, highest count first
+        """
+        keys = heapq.nlargest(n, self.counts, key=self.counts.get)
+        return [(key, self.counts[key], self.errors[key]) for key in keys]
+
+    def _push(self, key):
+        heapq.heappush(self._heap, (self.counts[key], key))
+        if len(self._heap) > 4 * self.capacity:
+            self._rebuild_heap()
+
+    def _pop_min(self):
+        while True:
+            count, key = heapq.heappop(self._heap)
+            if self.counts.get(key) == count:
+                return key, count
+
+    def _rebuild_heap(self):
+        self._heap = [(count, key) for key, count in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def __getstate__(self):
+        # The heap is derived data; leave it out of pickles
+        return {'capacity': self.capacity, 'counts': self.counts, 'errors': self.errors}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._rebuild_heap()
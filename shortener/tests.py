@@ -1,3 +1,899 @@
-from django.test import TestCase
+# shortener/tests.py
+import copy
+import hashlib
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import CommandError
+from django.contrib.sessions.models import Session
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, IntegrityError, connections, transaction
+from django.db.models import QuerySet
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from .hyperloglog import HyperLogLog
+from . import clicks, link_checker, prefork, sessions, snapshot, trending, visitors
+from .clicks import ClickBuffer
+from .link_checker import check_links
+from .models import APIToken, ArchivedURL, ExpiredURL, LinkHealth, ShortenedURL, UserProfile, VisitorSketch
+from .photo_utils import save_profile_photo
+from .search import FTS_TABLE, search_links, url_tokens
+from .sharding import shard_for
+from .spacesaving import SpaceSaving
+from .visitors import VisitorBuffer, unique_visitors, write_sketches
+
+SHARDS = ['shard_a', 'shard_b']
+LOCMEM_CACHES = {
+    alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': alias}
+    for alias in ('default', 'qr', 'sessions', 'snapshot', 'trending')
+}
+
+
+def flush_counters():
+    """Write out what redirects buffered, while the test's database and caches are still in place"""
+    clicks.click_buffer.flush()
+    visitors.visitor_buffer.flush()
+    trending.trending_buffer.flush()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """A destination site with one behaviour per path"""
+
+    def do_HEAD(self):
+        if self.path == '/no-head':
+            self.respond(405)
+        else:
+            self.do_GET()
+
+    def do_GET(self):
+        if self.path == '/slow':
+            time.sleep(0.2)
+            self.respond(200)
+        elif self.path == '/missing':
+            self.respond(404)
+        elif self.path == '/moved':
+            self.respond(301, Location='/slow')
+        elif self.path == '/loop':
+            self.respond(302, Location='/loop')
+        elif self.path == '/to-metadata':
+            self.respond(302, Location='http://169.254.169.254/latest/meta-data/')
+        else:
+            self.respond(200)
+
+    def respond(self, status, **headers):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServerMixin:
+    """Serve StandInHandler on a loopback port for the test class"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_address[1]}'
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+
+class LinkCheckerTests(StandInServerMixin, SimpleTestCase):
+    def check(self, paths, **options):
+        items = [(path, self.base_url + path) for path in paths]
+        return check_links(items, allow_private_addresses=True, **options)
+
+    def test_queued_links_do_not_time_out(self):
+        # 20 links at 2 at a time take ~2s in total; each one only ~0.2s
+        results = self.check(['/slow'] * 20, concurrency=50, per_host=2, timeout=1)
+        self.assertEqual([r.status_code for r in results], [200] * 20)
+        self.assertTrue(all(r.latency_ms < 1000 for r in results))
+
+    def test_slow_response_times_out(self):
+        [result] = self.check(['/slow'], concurrency=1, per_host=1, timeout=0.05)
+        self.assertIsNone(result.status_code)
+        self.assertEqual(result.error, 'Timed out')
+
+    def test_status_codes(self):
+        results = self.check(['/ok', '/missing', '/moved', '/no-head'], concurrency=4, per_host=4, timeout=5)
+        self.assertEqual([r.status_code for r in results], [200, 404, 200, 200])
+        self.assertEqual([r.key for r in results], ['/ok', '/missing', '/moved', '/no-head'])
+
+    def test_redirect_loop(self):
+        [result] = self.check(['/loop'], concurrency=1, per_host=1, timeout=5)
+        self.assertIsNone(result.status_code)
+        self.assertEqual(result.error, 'Too many redirects')
+
+    def test_non_public_addresses_are_refused(self):
+        urls = [self.base_url + '/ok', 'http://169.254.169.254/latest/meta-data/', 'https://10.0.0.1/',
+                'http://[::1]/', 'http://[::ffff:127.0.0.1]/']
+        results = check_links(enumerate(urls), timeout=5)
+        self.assertEqual([r.status_code for r in results], [None] * len(urls))
+        for result in results:
+            self.assertTrue(result.error.startswith('Refused to connect to non-public address'), result.error)
+
+    def test_redirects_to_non_public_addresses_are_refused(self):
+        checker_class = link_checker.LinkChecker
+
+        class LoopbackOnlyChecker(checker_class):
+            """Lets the stand-in server through, as if it were public"""
+            async def _resolve(self, host, port):
+                self.allow_private_addresses = host == '127.0.0.1'
+                return await super()._resolve(host, port)
+
+        with mock.patch.object(link_checker, 'LinkChecker', LoopbackOnlyChecker):
+            [result] = check_links([('k', self.base_url + '/to-metadata')], timeout=5)
+        self.assertIsNone(result.status_code)
+        self.assertEqual(result.error, 'Refused to connect to non-public address 169.254.169.254')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CheckLinksCommandTests(StandInServerMixin, TestCase):
+    def test_private_addresses_are_only_checked_when_allowed(self):
+        owner = User.objects.create_user('owner')
+        link = ShortenedURL.objects.create(original_url=self.base_url + '/ok', short_code='local', user=owner)
+        call_command('check_links', stdout=StringIO())
+        self.assertTrue(LinkHealth.objects.get(url=link).is_broken)
+
+        # The owner is told the link is unreachable, not what the checker saw
+        self.client.force_login(owner)
+        for page in ('/my-urls/', '/stats/local/'):
+            with self.subTest(page=page):
+                response = self.client.get(page)
+                self.assertContains(response, 'Unreachable')
+                self.assertNotContains(response, 'Refused')
+
+        with override_settings(LINK_CHECK_ALLOW_PRIVATE_ADDRESSES=True):
+            call_command('check_links', '--stale-hours=0', stdout=StringIO())
+        self.assertEqual(LinkHealth.objects.get(url=link).status_code, 200)
+
+    def test_connection_refused(self):
+        [result] = check_links([('down', 'http://127.0.0.1:1/')], concurrency=1, per_host=1, timeout=5)
+        self.assertIsNone(result.status_code)
+        self.assertTrue(result.error)
+
+
+@override_settings(SHORTENER_SHARDS=SHARDS, CACHES=LOCMEM_CACHES)
+class ShardingTests(TransactionTestCase):
+    """Links spread over two SQLite files while users stay on 'default'"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Added after setUpClass so the test runner leaves these files alone
+        cls.shard_dir = tempfile.TemporaryDirectory()
+        for alias in SHARDS:
+            connections.settings[alias] = {
+                **copy.deepcopy(connections.settings[DEFAULT_DB_ALIAS]),
+                'NAME': os.path.join(cls.shard_dir.name, f'{alias}.sqlite3'),
+            }
+            call_command('migrate', database=alias, run_syncdb=True, verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        for alias in SHARDS:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+        cls.shard_dir.cleanup()
+        super().tearDownClass()
+
+    def tearDown(self):
+        for alias in SHARDS:
+            call_command('flush', database=alias, interactive=False, verbosity=0)
+
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', password='secret')
+        self.bob = User.objects.create_user('bob', password='secret')
+        self.codes = [f'code{i}' for i in range(20)]
+        for code in self.codes:
+            ShortenedURL.objects.create(
+                short_code=code, original_url=f'https://example.com/{code}',
+                user=self.alice if code in self.codes[:10] else self.bob,
+            )
+
+    def codes_on(self, alias):
+        return set(ShortenedURL.objects.using(alias).values_list('short_code', flat=True))
+
+    def test_links_are_placed_by_code(self):
+        for alias in SHARDS:
+            self.assertTrue(self.codes_on(alias))
+            self.assertEqual(self.codes_on(alias), {code for code in self.codes if shard_for(code) == alias})
+        self.assertEqual(ShortenedURL.objects.for_code('code3').get().user, self.alice)
+
+    def test_admin_browses_one_shard_at_a_time(self):
+        User.objects.create_superuser('admin', password='secret')
+        self.client.login(username='admin', password='secret')
+        for alias in SHARDS:
+            response = self.client.get('/admin/shortener/shortenedurl/', {'shard': alias})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual({url.short_code for url in response.context['cl'].result_list}, self.codes_on(alias))
+
+        code = next(code for code in self.codes if shard_for(code) == SHARDS[1])
+        url_obj = ShortenedURL.objects.for_code(code).get()
+        LinkHealth.objects.using(SHARDS[1]).create(url=url_obj, status_code=404, checked_at=timezone.now())
+        response = self.client.get('/admin/shortener/linkhealth/', {'shard': SHARDS[1]})
+        self.assertEqual([health.url_id for health in response.context['cl'].result_list], [url_obj.pk])
+
+        change_url = f'/admin/shortener/shortenedurl/{url_obj.pk}/change/?_changelist_filters=shard%3D{SHARDS[1]}'
+        self.assertEqual(self.client.get(change_url).status_code, 200)
+        delete_url = change_url.replace('/change/', '/delete/')
+        self.assertContains(self.client.get(delete_url), 'Link health')
+        self.client.post(delete_url, {'post': 'yes'})
+        self.assertFalse(ShortenedURL.objects.for_code(code).exists())
+
+    def test_pregenerate_qr_codes_for_one_user(self):
+        out = StringIO()
+        call_command('pregenerate_qr_codes', '--base-url', 'https://sho.rt', '--user', 'alice', stdout=out)
+        self.assertIn('Rendered 10 QR code(s).', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('pregenerate_qr_codes', '--base-url', 'https://sho.rt', '--user', 'nobody')
+
+
+class VisitorSketchTests(TestCase):
+    def sketch(self, values):
+        sketch = HyperLogLog()
+        for value in values:
+            sketch.add(int.from_bytes(hashlib.sha256(str(value).encode()).digest()[:8], 'big'))
+        return sketch
+
+    def test_sketches_merge_into_one_row_per_day(self):
+        today = timezone.localdate()
+        write_sketches({('abc123', today): self.sketch(range(100))})
+        write_sketches({('abc123', today): self.sketch(range(50, 150))})
+
+        self.assertEqual(VisitorSketch.objects.filter(day=today).count(), 1)
+        self.assertEqual(VisitorSketch.objects.filter(day=VisitorSketch.ALL_TIME).count(), 1)
+        total, daily = unique_visitors('abc123')
+        self.assertAlmostEqual(total, 150, delta=10)
+        self.assertEqual([day for day, _ in daily], [today])
+
+    def test_all_time_sketch_is_unique(self):
+        VisitorSketch.objects.merge('abc123', VisitorSketch.ALL_TIME, self.sketch([1]))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            VisitorSketch.objects.create(short_code='abc123', day=VisitorSketch.ALL_TIME, sketch=b'')
+
+    def test_all_time_sketch_is_never_stale(self):
+        VisitorSketch.objects.merge('abc123', VisitorSketch.ALL_TIME, self.sketch([1]))
+        VisitorSketch.objects.merge('abc123', date(2000, 1, 1), self.sketch([1]))
+        self.assertEqual(list(VisitorSketch.objects.stale().values_list('day', flat=True)), [date(2000, 1, 1)])
+
+    def test_failed_flush_is_retried(self):
+        failures = [Exception('database is locked')]
+
+        def sink(sketches):
+            if failures:
+                raise failures.pop()
+            write_sketches(sketches)
+
+        buffer = VisitorBuffer(flush_interval=60, sink=sink)
+        buffer.add('abc123', 1)
+        with self.assertLogs('shortener.visitors', 'ERROR'):
+            buffer.flush()
+        self.assertFalse(VisitorSketch.objects.exists())
+        buffer.flush()
+        self.assertEqual(unique_visitors('abc123')[0], 1)
+
+    def test_str(self):
+        self.assertEqual(str(VisitorSketch(short_code='abc', day=VisitorSketch.ALL_TIME)), 'abc (all time)')
+        self.assertEqual(str(VisitorSketch(short_code='abc', day=date(2024, 5, 1))), 'abc (2024-05-01)')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TrendingTests(SimpleTestCase):
+    def setUp(self):
+        trending.caches[settings.TRENDING_CACHE_ALIAS].clear()
+        trending._published.clear()
+
+    def publish_as(self, writer, counts):
+        summary = SpaceSaving()
+        for short_code, count in counts.items():
+            summary.add(short_code, count)
+        bucket = int(time.time() // trending.bucket_seconds())
+        # Each writer stands in for a separate process with its own running totals
+        with mock.patch.object(trending, 'writer_id', return_value=writer), \
+                mock.patch.dict(trending._published, self.published.setdefault(writer, {}), clear=True):
+            trending.publish_buckets({bucket: summary})
+            self.published[writer] = dict(trending._published)
+
+    def test_processes_do_not_overwrite_each_other(self):
+        self.published = {}
+        self.publish_as('host:1', {'abc': 3, 'xyz': 1})
+        self.publish_as('host:2', {'abc': 2})
+        self.publish_as('host:1', {'abc': 1})
+        self.assertEqual(trending.trending_links(), [('abc', 6, 0), ('xyz', 1, 0)])
+
+    def test_failed_publish_is_retried_without_double_counting(self):
+        bucket = int(time.time() // trending.bucket_seconds())
+        summary = SpaceSaving()
+        summary.add('abc', 2)
+        buckets = {bucket: summary}
+        cache = trending.caches[settings.TRENDING_CACHE_ALIAS]
+        with mock.patch.object(cache, 'set', side_effect=[None, OSError]), self.assertRaises(OSError):
+            trending.publish_buckets(buckets)
+        trending.publish_buckets(buckets)
+        self.assertEqual(trending.trending_links(), [('abc', 2, 0)])
+
+    def test_buffer_requeues_what_a_failed_flush_did_not_publish(self):
+        published = []
+
+        def publish_one_then_fail(buckets):
+            # Publishes buckets oldest first, removing each, like publish_buckets
+            for bucket in sorted(buckets):
+                published.append((bucket, dict(buckets.pop(bucket).counts)))
+                if len(published) == 1:
+                    raise OSError('cache unavailable')
+
+        buffer = trending.TrendingBuffer(flush_interval=3600, sink=publish_one_then_fail)
+        for bucket, short_code in ((0, 'abc'), (1, 'xyz'), (1, 'xyz')):
+            with mock.patch.object(trending.time, 'time', return_value=bucket * trending.bucket_seconds()):
+                buffer.add(short_code)
+        with self.assertLogs('shortener.trending', 'ERROR'):
+            buffer.flush()
+        with mock.patch.object(trending.time, 'time', return_value=trending.bucket_seconds()):
+            buffer.add('abc')
+        buffer.flush()
+        self.assertEqual(published, [(0, {'abc': 1}), (1, {'xyz': 2, 'abc': 1})])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ArchivedLinkAPITests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='secret')
+        _, key = APIToken.create_for_user(self.user)
+        self.auth = {'HTTP_AUTHORIZATION': f'Token {key}'}
+        url_obj = ShortenedURL.objects.create(user=self.user, short_code='old123', original_url='https://example.com/')
+        ArchivedURL.from_shortened_url(url_obj).save()
+        url_obj.delete()
+
+    def test_reading_does_not_promote(self):
+        response = self.client.get('/api/v1/links/old123/', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['archived'])
+        self.assertEqual(self.client.get('/api/v1/links/old123/stats/', **self.auth).status_code, 200)
+
+        response = self.client.get('/api/v1/links/old123/', HTTP_IF_NONE_MATCH=response['ETag'], **self.auth)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(ShortenedURL.objects.exists())
+        self.assertTrue(ArchivedURL.objects.filter(short_code='old123').exists())
+
+    def test_delete_quarantines_the_code(self):
+        response = self.client.delete('/api/v1/links/old123/', **self.auth)
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(ArchivedURL.objects.exists())
+        self.assertFalse(ShortenedURL.objects.exists())
+        self.assertTrue(ExpiredURL.objects.quarantined().filter(short_code='old123').exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CLICK_FLUSH_INTERVAL=0)
+class ExpiryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='secret')
+        self.addCleanup(flush_counters)
+
+    def link(self, short_code='abc123', **fields):
+        return ShortenedURL.objects.create(user=self.user, short_code=short_code,
+                                           original_url='https://example.com/', **fields)
+
+    def test_click_limit_is_never_exceeded(self):
+        url_obj = self.link(max_clicks=2)
+        # A second copy stands in for a concurrent request holding a stale row
+        stale = ShortenedURL.objects.get(pk=url_obj.pk)
+        self.assertTrue(url_obj.register_click())
+        self.assertTrue(url_obj.register_click())
+        self.assertFalse(stale.register_click())
+        self.assertEqual(ShortenedURL.objects.get(pk=url_obj.pk).clicks, 2)
+
+    def test_expired_links_answer_gone(self):
+        self.link('limited', max_clicks=1)
+        self.link('past', expires_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(self.client.get('/limited/').status_code, 302)
+        self.assertEqual(self.client.get('/limited/').status_code, 410)
+        self.assertEqual(self.client.get('/past/').status_code, 410)
+
+    def test_reaper_archives_expired_links_and_quarantines_their_codes(self):
+        self.link('past', expires_at=timezone.now() - timedelta(minutes=1))
+        self.link('used', max_clicks=1, clicks=1)
+        self.link('live', expires_at=timezone.now() + timedelta(days=1))
+        call_command('reap_expired_links', '--batch-size', '1', stdout=StringIO())
+
+        self.assertEqual(list(ShortenedURL.objects.values_list('short_code', flat=True)), ['live'])
+        self.assertEqual(set(ExpiredURL.objects.values_list('short_code', flat=True)), {'past', 'used'})
+        self.assertFalse(ShortenedURL.is_code_available('past'))
+        self.assertFalse(ShortenedURL.is_code_available('live'))
+        self.assertTrue(ShortenedURL.is_code_available('other'))
+
+    def test_quarantine_ends(self):
+        self.link('past', expires_at=timezone.now() - timedelta(minutes=1))
+        call_command('reap_expired_links', stdout=StringIO())
+        ExpiredURL.objects.update(expired_at=timezone.now() - timedelta(days=settings.LINK_CODE_QUARANTINE_DAYS + 1))
+        self.assertTrue(ShortenedURL.is_code_available('past'))
+        call_command('reap_expired_links', '--purge', stdout=StringIO())
+        self.assertFalse(ExpiredURL.objects.exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CLICK_FLUSH_INTERVAL=0)
+class TieringTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='secret')
+        self.addCleanup(flush_counters)
+        self.long_ago = timezone.now() - timedelta(days=settings.LINK_ARCHIVE_IDLE_DAYS + 1)
+
+    def link(self, short_code, **fields):
+        url_obj = ShortenedURL.objects.create(user=self.user, short_code=short_code,
+                                              original_url=f'https://example.com/{short_code}', **fields)
+        ShortenedURL.objects.filter(pk=url_obj.pk).update(created_at=self.long_ago)
+        return url_obj
+
+    def test_idle_links_are_archived_and_promoted_on_click(self):
+        self.link('idle', clicks=3, last_clicked_at=self.long_ago)
+        self.link('never')
+        self.link('busy', clicks=3, last_clicked_at=timezone.now())
+        call_command('tier_links', stdout=StringIO())
+
+        self.assertEqual(list(ShortenedURL.objects.values_list('short_code', flat=True)), ['busy'])
+        archived = ArchivedURL.objects.get(short_code='idle')
+        self.assertEqual((archived.clicks, archived.created_at), (3, self.long_ago))
+
+        response = self.client.get('/idle/')
+        self.assertRedirects(response, 'https://example.com/idle', fetch_redirect_response=False)
+        promoted = ShortenedURL.objects.get(short_code='idle')
+        self.assertEqual((promoted.clicks, promoted.created_at), (4, self.long_ago))
+        self.assertFalse(ArchivedURL.objects.filter(short_code='idle').exists())
+
+    def test_links_clicked_before_tracking_are_not_archived(self):
+        self.link('untracked', clicks=5)
+        call_command('tier_links', stdout=StringIO())
+        url_obj = ShortenedURL.objects.get(short_code='untracked')
+        self.assertIsNotNone(url_obj.last_clicked_at)
+        self.assertFalse(ArchivedURL.objects.exists())
+
+    def test_stats_page_leaves_archived_links_archived(self):
+        self.link('idle', last_clicked_at=self.long_ago)
+        call_command('tier_links', stdout=StringIO())
+        response = self.client.get('/stats/idle/')
+        self.assertContains(response, 'https://example.com/idle')
+        self.assertTrue(response.context['is_archived'])
+        self.assertFalse(ShortenedURL.objects.exists())
+        self.assertEqual(self.client.get('/stats/nothing/').status_code, 404)
+
+
+class SnapshotFileTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'redirects.snap')
+
+    def test_layout_and_lookup(self):
+        expires_at = datetime(2030, 1, 1, tzinfo=dt_timezone.utc)
+        count = snapshot.write_snapshot(self.path, [
+            ('zz', 'https://example.com/z', None),
+            ('abc', 'https://example.com/é', expires_at),
+            ('ab', 'https://example.com/b', None),
+        ])
+        self.assertEqual(count, 3)
+
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        self.assertEqual(snapshot.HEADER.unpack_from(data), (b'RSNP', 1, 3))
+        # Offsets point at records sorted by code
+        offsets = [snapshot.OFFSET.unpack_from(data, snapshot.HEADER.size + 4 * i)[0] for i in range(3)]
+        self.assertEqual(offsets[0], snapshot.HEADER.size + 4 * 3)
+        self.assertEqual(snapshot.RECORD.unpack_from(data, offsets[1]),
+                         (3, int(expires_at.timestamp()), len('https://example.com/é'.encode())))
+
+        snap = snapshot.RedirectSnapshot(self.path)
+        self.assertEqual(len(snap), 3)
+        self.assertEqual(snap.lookup('ab'), ('https://example.com/b', None))
+        self.assertEqual(snap.lookup('abc'), ('https://example.com/é', expires_at))
+        self.assertEqual(snap.lookup('zz'), ('https://example.com/z', None))
+        for missing in ('a', 'abd', 'zzz', ''):
+            self.assertIsNone(snap.lookup(missing))
+
+    def test_other_files_are_rejected(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'XXXX' + bytes(10))
+        with self.assertRaises(ValueError):
+            snapshot.RedirectSnapshot(self.path)
+
+    def test_replaced_file_is_reloaded(self):
+        with override_settings(REDIRECT_SNAPSHOT_PATH=self.path, REDIRECT_SNAPSHOT_CHECK_INTERVAL=0):
+            self.assertIsNone(snapshot.get_snapshot())
+            snapshot.write_snapshot(self.path, [('abc', 'https://example.com/1', None)])
+            first = snapshot.get_snapshot()
+            self.assertIs(snapshot.get_snapshot(), first)
+            snapshot.write_snapshot(self.path, [('abc', 'https://example.com/2', None)])
+            self.assertEqual(snapshot.get_snapshot().lookup('abc'), ('https://example.com/2', None))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CLICK_FLUSH_INTERVAL=0, REDIRECT_SNAPSHOT_CHECK_INTERVAL=0)
+class SnapshotRedirectTests(TestCase):
+    def setUp(self):
+        self.addCleanup(flush_counters)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'redirects.snap')
+        settings_override = override_settings(REDIRECT_SNAPSHOT_PATH=path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user('alice', password='secret')
+        self.url_obj = ShortenedURL.objects.create(user=self.user, short_code='evil1',
+                                                   original_url='https://example.com/old')
+        call_command('build_redirect_snapshot', stdout=StringIO())
+        snapshot.caches[settings.REDIRECT_SNAPSHOT_CACHE_ALIAS].clear()
+
+        User.objects.create_superuser('admin', password='secret')
+        self.client.login(username='admin', password='secret')
+
+    def assertRedirectsTo(self, url):
+        self.assertRedirects(self.client.get('/evil1/'), url, fetch_redirect_response=False)
+
+    def test_snapshot_serves_and_counts_clicks(self):
+        with mock.patch.object(ShortenedURL, 'resolve') as resolve:
+            self.assertRedirectsTo('https://example.com/old')
+        resolve.assert_not_called()
+        self.assertEqual(ShortenedURL.objects.get(pk=self.url_obj.pk).clicks, 1)
+
+    def test_admin_edit_revokes_the_code(self):
+        change_url = f'/admin/shortener/shortenedurl/{self.url_obj.pk}/change/'
+        response = self.client.post(change_url, {
+            'original_url': 'https://example.com/new', 'user': self.user.pk, 'expires_at_0': '', 'expires_at_1': '',
+            'max_clicks': '', 'last_clicked_at_0': '', 'last_clicked_at_1': '',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertRedirectsTo('https://example.com/new')
+
+    def test_admin_delete_revokes_and_quarantines_the_code(self):
+        delete_url = f'/admin/shortener/shortenedurl/{self.url_obj.pk}/delete/'
+        self.client.post(delete_url, {'post': 'yes'})
+        self.assertEqual(self.client.get('/evil1/').status_code, 404)
+        self.assertFalse(ShortenedURL.is_code_available('evil1'))
+
+    def test_archived_link_is_revoked(self):
+        ShortenedURL.objects.update(last_clicked_at=timezone.now() - timedelta(days=365))
+        call_command('tier_links', stdout=StringIO())
+        self.assertRedirectsTo('https://example.com/old')
+        # Served from the database, which promoted the link
+        self.assertTrue(ShortenedURL.objects.filter(short_code='evil1').exists())
+
+
+class ClickBufferTests(TestCase):
+    def test_failed_flush_is_retried(self):
+        calls = []
+
+        def sink(counts):
+            calls.append(dict(counts))
+            if len(calls) == 1:
+                # The first code was written before the failure
+                del counts['a']
+                raise Exception('database is locked')
+
+        buffer = ClickBuffer(flush_interval=60, sink=sink)
+        buffer.add('a', 2)
+        buffer.add('b', 3)
+        with self.assertLogs('shortener.clicks', 'ERROR'):
+            buffer.flush()
+        buffer.add('b')
+        buffer.flush()
+        self.assertEqual(calls, [{'a': 2, 'b': 3}, {'b': 4}])
+
+
+class StatsMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        self.stats = multiprocessing.Array('d', 2 * len(prefork.STAT_FIELDS))
+
+    def app(self, status):
+        def app(environ, start_response):
+            if status is None:
+                raise RuntimeError('boom')
+            start_response(status, [])
+            return [b'']
+        return app
+
+    def test_requests_are_counted_by_outcome_in_the_worker_slot(self):
+        for status in ('302 Found', '302 Found', '404 Not Found', '200 OK', '503 Service Unavailable', None):
+            middleware = prefork.StatsMiddleware(self.app(status), self.stats, slot=1)
+            try:
+                middleware({}, lambda status, headers, exc_info=None: None)
+            except RuntimeError:
+                pass
+        slot = dict(zip(prefork.STAT_FIELDS, self.stats[len(prefork.STAT_FIELDS):]))
+        self.assertEqual(self.stats[:len(prefork.STAT_FIELDS)], [0] * len(prefork.STAT_FIELDS))
+        self.assertEqual((slot['requests'], slot['redirects'], slot['not_found'], slot['errors']), (6, 2, 1, 2))
+        self.assertGreaterEqual(slot['total_ms'], 0)
+
+
+@mock.patch.object(prefork.signal, 'signal')
+@mock.patch.object(prefork.db.connections, 'close_all')
+class FlusherTests(SimpleTestCase):
+    def test_failed_writes_are_retried(self, close_all, set_signal):
+        written = []
+
+        def write_clicks(counts):
+            if not written:
+                written.append(None)
+                raise Exception('database is locked')
+            written.append(dict(counts))
+            counts.clear()
+
+        click_queue = queue.Queue()
+        for item in (('clicks', {'a': 2}), ('clicks', {'a': 1, 'b': 1}), None):
+            click_queue.put(item)
+        with mock.patch.object(prefork.clicks, 'write_clicks', side_effect=write_clicks), \
+                self.assertLogs('shortener.prefork', 'ERROR'):
+            prefork.run_flusher(click_queue, flush_interval=0)
+        self.assertEqual(written, [None, {'a': 3, 'b': 1}])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class QRCodeTests(TestCase):
+    def setUp(self):
+        ShortenedURL.objects.create(original_url='https://example.com/', short_code='qrlink')
+
+    def test_png_and_svg_are_served_with_an_etag(self):
+        png = self.client.get('/qr/qrlink.png')
+        svg = self.client.get('/qr/qrlink.svg?size=4&ec=h')
+        self.assertEqual((png.status_code, png['Content-Type']), (200, 'image/png'))
+        self.assertTrue(png.content.startswith(b'\x89PNG'))
+        self.assertEqual((svg.status_code, svg['Content-Type']), (200, 'image/svg+xml'))
+        self.assertNotEqual(png['ETag'], svg['ETag'])
+
+    def test_matching_etag_is_not_modified(self):
+        etag = self.client.get('/qr/qrlink.png')['ETag']
+        response = self.client.get('/qr/qrlink.png', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_unknown_code_is_not_found_even_when_revalidating(self):
+        etag = self.client.get('/qr/qrlink.png')['ETag']
+        ShortenedURL.objects.filter(short_code='qrlink').delete()
+        self.assertEqual(self.client.get('/qr/qrlink.png', HTTP_IF_NONE_MATCH=etag).status_code, 404)
+        self.assertEqual(self.client.get('/qr/nosuch.png', HTTP_IF_NONE_MATCH='*').status_code, 404)
+
+    def test_bad_options_are_not_found(self):
+        for path in ('/qr/qrlink.gif', '/qr/qrlink.png?size=0', '/qr/qrlink.png?size=41',
+                     '/qr/qrlink.png?size=big', '/qr/qrlink.png?ec=Z'):
+            with self.subTest(path=path):
+                self.assertEqual(self.client.get(path).status_code, 404)
+
+
+class ProfilePhotoTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name, PROFILE_PHOTO_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.alice = User.objects.create_user('alice').profile
+        self.bob = User.objects.create_user('bob').profile
+
+    def upload(self, profile, content, name='me.jpg'):
+        save_profile_photo(profile, SimpleUploadedFile(name, content))
+        profile.refresh_from_db()
+        return profile
+
+    def photo_with_gps(self):
+        from PIL import Image
+
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: rotated 90 degrees
+        exif[0x8825] = {2: (51.0, 30.0, 0.0)}  # GPSInfo: latitude
+        buffer = BytesIO()
+        Image.new('RGB', (80, 40), 'red').save(buffer, format='JPEG', exif=exif)
+        return buffer.getvalue()
+
+    def test_metadata_is_stripped_and_orientation_applied(self):
+        from PIL import Image
+
+        profile = self.upload(self.alice, self.photo_with_gps())
+        self.assertTrue(profile.photo_thumbnails_ready)
+        with default_storage.open(profile.photo.name) as f:
+            original = Image.open(f)
+            self.assertEqual(original.size, (40, 80))
+            self.assertEqual(dict(original.getexif()), {})
+        for size in settings.PROFILE_PHOTO_THUMBNAIL_SIZES:
+            for fmt in ('jpeg', 'webp'):
+                with default_storage.open(UserProfile.thumbnail_name(profile.photo_hash, size, fmt)) as f:
+                    thumbnail = Image.open(f)
+                    self.assertEqual(thumbnail.size, (size, size))
+                    self.assertEqual(dict(thumbnail.getexif()), {})
+        self.assertIn(profile.photo_hash, profile.get_photo_url())
+
+    def test_identical_uploads_are_stored_and_processed_once(self):
+        content = self.photo_with_gps()
+        alice = self.upload(self.alice, content)
+        with mock.patch('shortener.photo_utils.generate_thumbnails') as generate_thumbnails:
+            bob = self.upload(self.bob, content, name='other-name.jpg')
+        generate_thumbnails.assert_not_called()
+        self.assertEqual((bob.photo_hash, bob.photo.name), (alice.photo_hash, alice.photo.name))
+        self.assertTrue(bob.photo_thumbnails_ready)
+        self.assertEqual(len(default_storage.listdir(os.path.dirname(alice.photo.name))[1]), 1)
+
+    def test_failed_processing_is_shown_and_can_be_retried(self):
+        with mock.patch('shortener.photo_utils.generate_thumbnails', side_effect=OSError('disk full')), \
+                self.assertLogs('shortener.photo_utils', 'ERROR'):
+            profile = self.upload(self.alice, self.photo_with_gps())
+        self.assertEqual((profile.photo_thumbnails_ready, profile.photo_processing_failed), (False, True))
+        self.assertIsNone(profile.get_photo_url())
+        self.client.force_login(self.alice.user)
+        self.assertContains(self.client.get('/profile/edit/'), 'could not be processed')
+
+        out = StringIO()
+        call_command('process_profile_photos', '--failed-only', stdout=out)
+        self.assertIn('Processed 1 profile photo(s), 0 failed.', out.getvalue())
+        profile.refresh_from_db()
+        self.assertEqual((profile.photo_thumbnails_ready, profile.photo_processing_failed), (True, False))
+        self.assertNotContains(self.client.get('/profile/edit/'), 'could not be processed')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+@mock.patch.object(sessions, 'schedule_flush')
+class WriteBehindSessionTests(TestCase):
+    def setUp(self):
+        self.addCleanup(sessions._pending.clear)
+        store = sessions.SessionStore()
+        store['cart'] = 1
+        store.save()
+        self.session_key = store.session_key
+
+    def stored_data(self):
+        session = Session.objects.filter(session_key=self.session_key).first()
+        return session and session.get_decoded()
+
+    def test_unchanged_session_is_not_saved(self, schedule_flush):
+        store = sessions.SessionStore(self.session_key)
+        store['cart'] = 1
+        store.save()
+        self.assertEqual(sessions._pending, {})
+        schedule_flush.assert_not_called()
+
+    def test_changes_are_cached_at_once_and_written_in_a_batch(self, schedule_flush):
+        store = sessions.SessionStore(self.session_key)
+        store['cart'] = 2
+        store.save()
+        schedule_flush.assert_called_once()
+        self.assertEqual(sessions.SessionStore(self.session_key)['cart'], 2)
+        self.assertEqual(self.stored_data(), {'cart': 1})
+
+        sessions.flush_pending()
+        self.assertEqual(sessions._pending, {})
+        self.assertEqual(self.stored_data(), {'cart': 2})
+
+    def test_changes_queued_elsewhere_do_not_bring_back_a_deleted_session(self, schedule_flush):
+        store = sessions.SessionStore(self.session_key)
+        store['cart'] = 2
+        store.save()
+        queued_in_another_process = dict(sessions._pending)
+
+        sessions.SessionStore(self.session_key).delete()
+        self.assertEqual(sessions._pending, {})
+        self.assertIsNone(self.stored_data())
+
+        sessions._pending.update(queued_in_another_process)
+        self.assertEqual(sessions.SessionStore(self.session_key).load(), {})
+        sessions.flush_pending()
+        self.assertIsNone(self.stored_data())
+
+    def test_failed_write_is_requeued_without_replacing_newer_changes(self, schedule_flush):
+        other = sessions.SessionStore()
+        other.save()
+        for session_key, value in ((self.session_key, 2), (other.session_key, 2)):
+            store = sessions.SessionStore(session_key)
+            store['cart'] = value
+            store.save()
+
+        def newer_change_then_fail(*args, **kwargs):
+            store = sessions.SessionStore(other.session_key)
+            store['cart'] = 3
+            store.save()
+            raise DatabaseError('database is locked')
+
+        with mock.patch.object(QuerySet, 'bulk_create', side_effect=newer_change_then_fail), \
+                self.assertRaises(DatabaseError):
+            sessions.flush_pending()
+        self.assertEqual(set(sessions._pending), {self.session_key, other.session_key})
+
+        sessions.flush_pending()
+        self.assertEqual(self.stored_data(), {'cart': 2})
+        self.assertEqual(Session.objects.get(session_key=other.session_key).get_decoded(), {'cart': 3})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice')
+
+    def codes(self, model, query):
+        return sorted(search_links(model.objects.filter(user=self.user), query).values_list('short_code', flat=True))
+
+    def indexed_tokens(self, url_obj):
+        with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+            cursor.execute(f'SELECT short_code, tokens FROM {FTS_TABLE} WHERE rowid = %s', [url_obj.pk])
+            return cursor.fetchone()
+
+    def test_url_tokens(self):
+        self.assertEqual(url_tokens('HTTPS://Docs.Example.com:8080/Guide/intro-2.html?lang=en#top'),
+                         'docs example com guide intro 2 html lang en')
+        self.assertEqual(url_tokens('mailto:someone'), 'someone')
+
+    def test_index_follows_saves_and_deletes(self):
+        link = ShortenedURL.objects.create(original_url='https://example.com/guide', short_code='Docs1', user=self.user)
+        self.assertEqual(self.indexed_tokens(link), ('docs1', 'example com guide'))
+        self.assertEqual(self.codes(ShortenedURL, 'exam gui'), ['Docs1'])
+
+        link.original_url = 'https://python.org/tutorial'
+        link.save()
+        self.assertEqual(self.codes(ShortenedURL, 'example'), [])
+        self.assertEqual(self.codes(ShortenedURL, 'tutor'), ['Docs1'])
+
+        link.delete()
+        self.assertIsNone(self.indexed_tokens(link))
+
+    def test_archived_links_match_by_the_same_rule(self):
+        url = 'https://example.com/Some_Guide'
+        ShortenedURL.objects.create(original_url=url, short_code='hot-1', user=self.user)
+        ArchivedURL.objects.create(original_url=url, short_code='cold-1', user=self.user, created_at=timezone.now())
+        for query, found in (('exam', True), ('GUIDE', True), ('some com', True), ('hot', None), ('cold', None),
+                             ('xampl', False), ('https', False), ('ome', False), ('example missing', False)):
+            with self.subTest(query=query):
+                hot, cold = self.codes(ShortenedURL, query), self.codes(ArchivedURL, query)
+                if found is None:
+                    self.assertEqual(len(hot) + len(cold), 1)
+                else:
+                    self.assertEqual((bool(hot), bool(cold)), (found, found))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class LinkStatsAPITests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('alice')
+        _, key = APIToken.create_for_user(user)
+        self.auth = {'HTTP_AUTHORIZATION': f'Token {key}'}
+        ShortenedURL.objects.create(user=user, short_code='live12', original_url='https://example.com/')
+
+    def revalidate(self, etag):
+        return self.client.get('/api/v1/links/live12/stats/', HTTP_IF_NONE_MATCH=etag, **self.auth)
+
+    def test_etag_changes_with_health_checks_and_visitor_counts(self):
+        etag = self.revalidate('"none"')['ETag']
+        self.assertEqual(self.revalidate(etag).status_code, 304)
+
+        LinkHealth.objects.create(url=ShortenedURL.objects.get(), status_code=503, latency_ms=20,
+                                  checked_at=timezone.now())
+        response = self.revalidate(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['health']['status_code'], 503)
+        etag = response['ETag']
+        self.assertEqual(self.revalidate(etag).status_code, 304)
+
+        sketch = HyperLogLog()
+        sketch.add(int.from_bytes(hashlib.sha256(b'visitor').digest()[:8], 'big'))
+        write_sketches({('live12', timezone.localdate()): sketch})
+        response = self.revalidate(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['unique_visitors']['total'], 1)
+        self.assertEqual(self.revalidate(response['ETag']).status_code, 304)
@@ -0,0 +1,183 @@
+# shortener/trending.py
+"""
+Links trending over a sliding window.
+
+The window is split into TRENDING_BUCKETS time buckets. Each process counts
+redirects into a Space-Saving summary per bucket and periodically publishes
+its running total for the bucket under its own key in the trending cache, so
+concurrent processes never overwrite each other's counts. Readers merge the
+summaries of every process that published within the window and take the
+top entries, so memory and read cost stay bounded by TRENDING_CAPACITY per
+bucket and process however many links exist. Buckets age out of the window
+(and the cache) on their own.
+"""
+import atexit
+import logging
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .spacesaving import SpaceSaving
+
+logger = logging.getLogger(__name__)
+
+
+def bucket_seconds():
+    return settings.TRENDING_WINDOW / settings.TRENDING_BUCKETS
+
+
+def bucket_key(bucket, writer):
+    return f'trending:{bucket}:{writer}'
+
+
+def writer_id():
+    """Identifies this process among all that share the trending cache"""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+# Cache entry mapping each process that published recently to when it last did
+WRITERS_KEY = 'trending:writers'
+
+
+class TrendingBuffer:
+    """
+    Count redirects per time bucket in memory and publish them in batches.
+
+    Pending summaries are keyed by bucket number. A flush interval of 0
+    publishes every redirect straight away.
+    """
+
+    def __init__(self, flush_interval=0, sink=None):
+        self.flush_interval = flush_interval
+        self.sink = sink or publish_buckets
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def add(self, short_code):
+        """Count one redirect for a short code in the current bucket"""
+        bucket = int(time.time() // bucket_seconds())
+        with self._lock:
+            summary = self._buckets.get(bucket)
+            if summary is None:
+                summary = self._buckets[bucket] = SpaceSaving(settings.TRENDING_CAPACITY)
+            summary.add(short_code)
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        """Flush if at least flush_interval seconds have passed since the last flush"""
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Hand all pending bucket summaries to the sink"""
+        with self._lock:
+            buckets, self._buckets = self._buckets, {}
+            self._last_flush = time.monotonic()
+        if not buckets:
+            return
+        try:
+            self.sink(buckets)
+        except Exception:
+            # The sink leaves only the buckets it did not publish
+            logger.exception('Publishing trending counts failed; will retry')
+            with self._lock:
+                merge_buckets(self._buckets, buckets)
+
+
+def merge_buckets(pending, buckets):
+    """Fold a mapping of bucket -> summary into another, in place"""
+    for bucket, summary in buckets.items():
+        if bucket in pending:
+            pending[bucket].merge(summary)
+        else:
+            pending[bucket] = summary
+
+
+# This process's running total per bucket, as last published
+_published = {}
+# A forked child publishes under its own key and must not repeat its parent's counts
+os.register_at_fork(after_in_child=_published.clear)
+
+
+def publish_buckets(buckets):
+    """
+    Fold bucket summaries into this process's published totals in the cache.
+
+    Buckets are removed from ``buckets`` as they are published, so if a write
+    fails the mapping holds exactly the counts still to be published.
+
+    Args:
+        buckets: Mapping of bucket number to SpaceSaving summary
+    """
+    cache = caches[settings.TRENDING_CACHE_ALIAS]
+    # Keep each bucket until it has slid out of the window
+    timeout = settings.TRENDING_WINDOW + bucket_seconds()
+    writer = writer_id()
+    register_writer(cache, writer, timeout)
+    for bucket, summary in list(buckets.items()):
+        total = SpaceSaving(settings.TRENDING_CAPACITY)
+        if bucket in _published:
+            total.merge(_published[bucket])
+        total.merge(summary)
+        cache.set(bucket_key(bucket, writer), total, timeout)
+        _published[bucket] = total
+        del buckets[bucket]
+
+    oldest = int(time.time() // bucket_seconds()) - settings.TRENDING_BUCKETS
+    for bucket in [bucket for bucket in _published if bucket <= oldest]:
+        del _published[bucket]
+
+
+def register_writer(cache, writer, timeout):
+    """
+    Record that a process publishes trending buckets, so readers look up its keys.
+
+    The registry is rewritten at most once per bucket per process, and a
+    process re-registers whenever it finds itself missing, e.g. after losing
+    a concurrent update.
+    """
+    now = time.time()
+    writers = cache.get(WRITERS_KEY) or {}
+    if writers.get(writer, 0) > now - bucket_seconds():
+        return
+    writers = {other: seen for other, seen in writers.items() if seen > now - timeout}
+    writers[writer] = now
+    cache.set(WRITERS_KEY, writers, timeout)
+
+
+def trending_links(limit=10):
+    """
+    Links with the most redirects within the trending window.
+
+    Args:
+        limit: Maximum number of links to return
+
+    Returns:
+        List of (short code, estimated redirects, error bound), busiest first
+    """
+    cache = caches[settings.TRENDING_CACHE_ALIAS]
+    current = int(time.time() // bucket_seconds())
+    writers = cache.get(WRITERS_KEY) or {}
+    keys = [
+        bucket_key(bucket, writer)
+        for bucket in range(current - settings.TRENDING_BUCKETS + 1, current + 1)
+        for writer in writers
+    ]
+    window = SpaceSaving(settings.TRENDING_CAPACITY)
+    for summary in cache.get_many(keys).values():
+        window.merge(summary)
+    return window.top(limit)
+
+
+trending_buffer = TrendingBuffer(flush_interval=settings.TRENDING_FLUSH_INTERVAL)
+atexit.register(trending_buffer.flush)
+
+
+def record_redirect(short_code):
+    """Count a served redirect towards the trending list"""
+    trending_buffer.add(short_code)
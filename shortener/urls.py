@@ -1,6 +1,6 @@
 # shortener/urls.py
 from django.urls import path
-from . import views
+from . import api, views
 
 app_name = 'shortener'
 
@@ -16,5 +16,10 @@ urlpatterns = [
     path('password-reset/confirm/<str:token>/', views.password_reset_confirm, name='password_reset_confirm'),
     path('stats/<str:short_code>/', views.stats, name='stats'),
     path('identicon/<str:username>.png', views.serve_identicon, name='identicon'),
+    path('qr/<str:short_code>.<str:fmt>', views.serve_qr_code, name='qr_code'),
+    path('api/trending/', views.trending, name='trending'),
+    path('api/v1/links/', api.links, name='api_links'),
+    path('api/v1/links/<str:short_code>/', api.link, name='api_link'),
+    path('api/v1/links/<str:short_code>/stats/', api.link_stats, name='api_link_stats'),
     path('<str:short_code>/', views.redirect_url, name='redirect'),
 ]
\ No newline at end of file
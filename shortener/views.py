@@ -1,20 +1,44 @@
 # shortener/views.py
 from django.shortcuts import render, redirect, get_object_or_404
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.models import User
 from django.contrib import messages
-from django.http import HttpResponse
-from .models import ShortenedURL, PasswordResetToken, UserProfile
+from django.db.models import Count, Sum
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+from django.http import Http404, HttpResponse, HttpResponseGone, JsonResponse
+from .models import ShortenedURL, ArchivedURL, PasswordResetToken, UserProfile
 from .forms import URLForm, UserRegisterForm, UserLoginForm, PasswordResetRequestForm, PasswordResetConfirmForm, UserUpdateForm, ProfilePhotoUpdateForm
 from .email_utils import send_password_reset_email
 from .utils import get_identicon_url
 from .identicon_utils import generate_identicon_response
+from .qr_utils import CONTENT_TYPES, ERROR_CORRECTION_LEVELS, get_qr_code, qr_code_key
+from .clicks import record_click
+from .visitors import record_visit, unique_visitors
+from .trending import record_redirect, trending_links
+from .snapshot import get_snapshot, is_revoked
+from .search import search_links
+
+
+def get_url_or_404(short_code):
+    """Resolve a short code across the hot and archive tiers, or raise Http404"""
+    try:
+        return ShortenedURL.resolve(short_code)
+    except ShortenedURL.DoesNotExist:
+        raise Http404('No URL matches the given short code.')
 
 
 def home(request):
-    # Get total count of all shortened URLs
-    total_urls = ShortenedURL.objects.count()
+    # Get total count of all shortened URLs, archived ones included, on every shard
+    total_urls = sum(
+        queryset.count()
+        for model in (ShortenedURL, ArchivedURL)
+        for queryset in model.objects.on_shards()
+    )
 
     if request.method == 'POST':
         # Only allow logged-in users to shorten URLs
@@ -26,31 +50,17 @@ def home(request):
         if form.is_valid():
             original_url = form.cleaned_data['url']
             custom_code = form.cleaned_data.get('custom_code')
-
-            # If custom code provided, use it regardless of existing URLs
-            if custom_code:
-                short_code = custom_code
-                shortened = ShortenedURL.objects.create(
-                    original_url=original_url,
-                    short_code=short_code,
-                    user=request.user
-                )
-            else:
-                # Check if URL already exists for this user
-                existing = ShortenedURL.objects.filter(
-                    original_url=original_url,
-                    user=request.user
-                ).first()
-
-                if existing:
-                    shortened = existing
-                else:
-                    short_code = ShortenedURL.generate_short_code()
-                    shortened = ShortenedURL.objects.create(
-                        original_url=original_url,
-                        short_code=short_code,
-                        user=request.user
-                    )
+            expires_at = form.cleaned_data.get('expires_at')
+            max_clicks = form.cleaned_data.get('max_clicks')
+
+            # A custom code always creates a new link; otherwise an existing
+            # permanent link to the same URL is reused
+            shortened, _ = ShortenedURL.shorten(
+                request.user, original_url,
+                custom_code=custom_code,
+                expires_at=expires_at,
+                max_clicks=max_clicks
+            )
 
             short_url = request.build_absolute_uri(f'/{shortened.short_code}')
 
@@ -71,26 +81,93 @@ def home(request):
 
 @login_required
 def my_urls(request):
-    urls = ShortenedURL.objects.filter(user=request.user).order_by('-created_at')
-    return render(request, 'shortener/my_urls.html', {'urls': urls})
+    query = request.GET.get('q', '').strip()
+
+    # A user's links may be spread over several shards
+    urls = []
+    for queryset in ShortenedURL.objects.filter(user=request.user).select_related('health').on_shards():
+        if query:
+            queryset = search_links(queryset, query)
+        urls.extend(queryset)
+    urls.sort(key=lambda url: url.created_at, reverse=True)
+
+    archived_urls = []
+    for queryset in ArchivedURL.objects.filter(user=request.user).on_shards():
+        if query:
+            queryset = search_links(queryset, query)
+        archived_urls.extend(queryset)
+    archived_urls.sort(key=lambda url: url.created_at, reverse=True)
+
+    return render(request, 'shortener/my_urls.html', {
+        'urls': urls,
+        'archived_urls': archived_urls,
+        'total_urls': len(urls) + len(archived_urls),
+        'query': query
+    })
 
 
 def redirect_url(request, short_code):
-    url_obj = get_object_or_404(ShortenedURL, short_code=short_code)
-    url_obj.clicks += 1
-    url_obj.save()
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        # Serve straight from the memory-mapped snapshot; links created or
+        # deleted since it was built fall through
+        entry = snapshot.lookup(short_code)
+        if entry is not None and not is_revoked(short_code):
+            original_url, expires_at = entry
+            if expires_at is not None and timezone.now() >= expires_at:
+                return HttpResponseGone('This link has expired.')
+            record_click(short_code)
+            track_redirect(short_code, request)
+            return redirect(original_url)
+
+    url_obj = get_url_or_404(short_code)
+    # Expiry is checked on the row we already loaded; the reaper removes it later
+    if url_obj.is_expired() or not url_obj.register_click():
+        return HttpResponseGone('This link has expired.')
+    track_redirect(short_code, request)
     return redirect(url_obj.original_url)
 
 
+def track_redirect(short_code, request):
+    """Feed a served redirect to the unique visitor and trending counters"""
+    record_visit(short_code, request)
+    record_redirect(short_code)
+
+
+@staff_member_required
+def trending(request):
+    """JSON list of the links with the most redirects in the trending window"""
+    try:
+        limit = min(max(int(request.GET.get('limit', 10)), 1), settings.TRENDING_CAPACITY)
+    except ValueError:
+        limit = 10
+    response = JsonResponse({
+        'window_seconds': settings.TRENDING_WINDOW,
+        'links': [
+            {'short_code': short_code, 'redirects': count, 'error': error}
+            for short_code, count, error in trending_links(limit)
+        ],
+    })
+    patch_cache_control(response, private=True, max_age=settings.TRENDING_FLUSH_INTERVAL)
+    return response
+
+
 def stats(request, short_code):
-    url_obj = get_object_or_404(ShortenedURL, short_code=short_code)
+    # Pages like this get scraped; viewing one must not promote an archived link
+    url_obj = ShortenedURL.find(short_code)
+    if url_obj is None:
+        raise Http404('No URL matches the given short code.')
 
     # Check if user owns this URL
     is_owner = request.user.is_authenticated and url_obj.user == request.user
+    total_visitors, daily_visitors = unique_visitors(short_code)
 
     return render(request, 'shortener/stats.html', {
         'url_obj': url_obj,
-        'is_owner': is_owner
+        'is_archived': isinstance(url_obj, ArchivedURL),
+        'is_owner': is_owner,
+        'total_visitors': total_visitors,
+        'daily_visitors': daily_visitors,
     })
 
 
@@ -228,8 +305,13 @@ def profile(request):
     gravatar_url = get_identicon_url(request.user.username)
 
     # Get user's stats
-    total_urls = ShortenedURL.objects.filter(user=request.user).count()
-    total_clicks = sum(url.clicks for url in ShortenedURL.objects.filter(user=request.user))
+    total_clicks = 0
+    total_urls = 0
+    for model in (ShortenedURL, ArchivedURL):
+        for queryset in model.objects.filter(user=request.user).on_shards():
+            user_stats = queryset.aggregate(count=Count('pk'), clicks=Sum('clicks'))
+            total_urls += user_stats['count']
+            total_clicks += user_stats['clicks'] or 0
 
     context = {
         'profile': profile,
@@ -277,4 +359,48 @@ def serve_identicon(request, username):
     Generate and serve an identicon image for a given username.
     """
     image_buffer = generate_identicon_response(username)
-    return HttpResponse(image_buffer.getvalue(), content_type='image/png')
\ No newline at end of file
+    return HttpResponse(image_buffer.getvalue(), content_type='image/png')
+
+
+def _qr_code_params(request, short_code, fmt):
+    """Parse QR options from the query string, raising Http404 on bad input"""
+    if fmt not in CONTENT_TYPES:
+        raise Http404('Unsupported QR code format.')
+    error_correction = request.GET.get('ec', 'M').upper()
+    if error_correction not in ERROR_CORRECTION_LEVELS:
+        raise Http404('Unsupported error correction level.')
+    try:
+        box_size = int(request.GET.get('size', 10))
+    except ValueError:
+        raise Http404('Invalid QR code size.')
+    if not 1 <= box_size <= 40:
+        raise Http404('QR code size must be between 1 and 40.')
+    short_url = request.build_absolute_uri(f'/{short_code}')
+    return short_url, box_size, error_correction
+
+
+def _qr_code_etag(request, short_code, fmt):
+    short_url, box_size, error_correction = _qr_code_params(request, short_code, fmt)
+    # Checked here rather than in the view, which a matching If-None-Match skips
+    if not (ShortenedURL.objects.for_code(short_code).exists() or
+            ArchivedURL.objects.for_code(short_code).exists()):
+        raise Http404('No URL matches the given short code.')
+    return qr_code_key(short_url, fmt, box_size, error_correction)
+
+
+@condition(etag_func=_qr_code_etag)
+def serve_qr_code(request, short_code, fmt):
+    """
+    Serve a QR code for a short URL as PNG or SVG.
+
+    Query parameters: ``size`` (pixels per module, 1-40) and ``ec`` (error
+    correction level L, M, Q or H). Renderings are cached by content hash,
+    which is also the ETag, so repeat requests are a cache hit or a 304.
+    """
+    short_url, box_size, error_correction = _qr_code_params(request, short_code, fmt)
+    content = get_qr_code(short_url, fmt, box_size, error_correction)
+    response = HttpResponse(content, content_type=CONTENT_TYPES[fmt])
+    # Short enough that a deleted link's code stops being served from caches
+    # soon; revalidating costs one existence check and a 304
+    patch_cache_control(response, public=True, max_age=60 * 60)
+    return response
\ No newline at end of file
@@ -0,0 +1,140 @@
+# shortener/visitors.py
+"""
+Approximate unique visitors per link.
+
+Every redirect adds a keyed hash of the visitor's IP address and user agent
+to a HyperLogLog sketch for the link and the current day. Like click counts,
+sketches are buffered in memory and merged into VisitorSketch rows on flush;
+the row with day=VisitorSketch.ALL_TIME holds the all-time sketch, so the
+stats page reads a bounded number of small rows whatever the link's traffic.
+"""
+import atexit
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+
+from .hyperloglog import HyperLogLog
+
+logger = logging.getLogger(__name__)
+
+
+def visitor_hash(request):
+    """64-bit hash standing in for a visitor; the IP itself is never stored"""
+    ip = request.META.get('REMOTE_ADDR', '')
+    user_agent = request.META.get('HTTP_USER_AGENT', '')
+    digest = salted_hmac('shortener.visitors', f'{ip}|{user_agent}').digest()
+    return int.from_bytes(digest[:8], 'big')
+
+
+class VisitorBuffer:
+    """
+    Accumulate visitor sketches in memory and write them out in batches.
+
+    Pending sketches are keyed by (short code, day). A flush interval of 0
+    writes every visit straight away. Sketches that fail to write are kept
+    for the next flush rather than failing the request that triggered it;
+    merging a sketch twice does not change the estimate.
+    """
+
+    def __init__(self, flush_interval=0, sink=None):
+        self.flush_interval = flush_interval
+        self.sink = sink or write_sketches
+        self._sketches = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def add(self, short_code, value, day=None):
+        """Add a visitor hash to the link's sketch for the day"""
+        key = (short_code, day or timezone.localdate())
+        with self._lock:
+            sketch = self._sketches.get(key)
+            if sketch is None:
+                sketch = self._sketches[key] = HyperLogLog()
+            sketch.add(value)
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        """Flush if at least flush_interval seconds have passed since the last flush"""
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Hand all pending sketches to the sink"""
+        with self._lock:
+            sketches, self._sketches = self._sketches, {}
+            self._last_flush = time.monotonic()
+        if not sketches:
+            return
+        try:
+            self.sink(sketches)
+        except Exception:
+            logger.exception('Writing visitor sketches failed; will retry')
+            with self._lock:
+                merge_sketches(self._sketches, sketches)
+
+
+def merge_sketches(pending, sketches):
+    """Fold a mapping of (short code, day) -> sketch into another, in place"""
+    for key, sketch in sketches.items():
+        if key in pending:
+            pending[key].merge(sketch)
+        else:
+            pending[key] = sketch
+
+
+def write_sketches(sketches):
+    """
+    Merge buffered sketches into the database.
+
+    Args:
+        sketches: Mapping of (short code, day) to HyperLogLog
+    """
+    from .models import VisitorSketch
+
+    # Fold the day sketches of each link into its all-time sketch
+    totals = {}
+    for (short_code, day), sketch in sketches.items():
+        totals.setdefault((short_code, VisitorSketch.ALL_TIME), HyperLogLog(sketch.precision)).merge(sketch)
+    for (short_code, day), sketch in [*sketches.items(), *totals.items()]:
+        VisitorSketch.objects.merge(short_code, day, sketch)
+
+
+def unique_visitors(short_code, days=14):
+    """
+    Estimated unique visitors for a link.
+
+    Args:
+        short_code: The link's short code
+        days: Number of recent days to break the count down by
+
+    Returns:
+        Tuple of (all-time estimate, list of (day, estimate) newest first)
+    """
+    from .models import VisitorSketch
+
+    since = timezone.localdate() - timedelta(days=days - 1)
+    rows = VisitorSketch.objects.for_code(short_code).filter(Q(day__gte=since) | Q(day=VisitorSketch.ALL_TIME))
+    total = 0
+    daily = []
+    for day, data in rows.values_list('day', 'sketch'):
+        count = HyperLogLog.from_bytes(data).count()
+        if day == VisitorSketch.ALL_TIME:
+            total = count
+        else:
+            daily.append((day, count))
+    return total, sorted(daily, reverse=True)
+
+
+visitor_buffer = VisitorBuffer(flush_interval=settings.VISITOR_FLUSH_INTERVAL)
+atexit.register(visitor_buffer.flush)
+
+
+def record_visit(short_code, request):
+    """Count the requesting visitor towards a link's unique visitors"""
+    visitor_buffer.add(short_code, visitor_hash(request))